@@ -0,0 +1,104 @@
+from Game import Game, GameError, Mode
+import Database
+import struct
+import gzip
+import zlib
+
+# The Archive module copies saved games between databases (such as between installations) in a single archive file.
+# An archive starts with a header of the magic bytes and the archive format version, followed by one record for each game.
+# Each record is a header of the game's saved timestamp, winner, mode, computer difficulty, and the lengths of the fields which follow it: the game's name, the usernames of player 1 and 2, and the packed game (as made by the Game toBytes function).
+# Games are read from the database and written to the archive one at a time (and the other way around), so archives of any number of games can be made without loading every game at once.
+# An archive can be compressed with gzip, which is detected automatically when it is imported.
+
+MAGIC = b"PENTEARC"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("!8sB")
+_RECORD = struct.Struct("!qBBbHHHI")
+
+# The length written in place of a username for a player who wasn't logged in (or was the computer).
+_NO_PLAYER = 0xFFFF
+
+# The ArchiveError class is raised when a file being imported isn't a valid archive (including a compressed archive which can't be decompressed).
+class ArchiveError(Exception):
+    pass
+
+# Given a string (or None), returns it encoded as bytes along with the length written to the record for it.
+def _encode(string):
+    if string is None:
+        return b"", _NO_PLAYER
+    data = string.encode()
+    return data, len(data)
+
+# Given a file and a number of bytes, reads exactly that many bytes from the file, or raises an archive error if the file ends first.
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ArchiveError("The archive ends part of the way through a game")
+    return data
+
+# Given the bytes of a name or username read from an archive, returns it decoded as a string, or raises an archive error if it isn't valid UTF-8.
+def _decode(data):
+    try:
+        return data.decode()
+    except UnicodeDecodeError:
+        raise ArchiveError("The archive contains a name which isn't valid text")
+
+# Given a path, a username (or None to export every game), and whether to compress the archive, writes every saved game of the player (or every saved game) to an archive at the path.
+# Returns the number of games exported.
+def exportGames(path, username=None, compress=False):
+    numberOfGames = 0
+    with (gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb")) as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+        for name, whenSaved, game, winner, mode, compDifficulty, username1, username2 in Database.streamGameData(username):
+            name, nameLength = _encode(name)
+            username1, username1Length = _encode(username1)
+            username2, username2Length = _encode(username2)
+            f.write(_RECORD.pack(whenSaved, winner, mode.value, compDifficulty, nameLength, username1Length, username2Length, len(game)))
+            f.write(name + username1 + username2 + game)
+            numberOfGames += 1
+    return numberOfGames
+
+# Given an archive file which has been opened, yields the details of each game in it (in the form used by the database's addGameData function), reading one game at a time.
+# A compressed archive which is cut short or damaged raises an EOFError or zlib error while it is being read, which is raised as an archive error instead.
+def _readGames(f):
+    try:
+        yield from _readRecords(f)
+    except (EOFError, zlib.error) as e:
+        raise ArchiveError(f"The compressed archive is damaged ({e})") from e
+
+# Given an archive file which has been opened, yields the details of each game in it as readGames does, without handling errors raised by decompressing the archive.
+# Each packed game is checked by replaying it, so a damaged game is reported here rather than when it is loaded from the database.
+def _readRecords(f):
+    magic, version = _HEADER.unpack(_read(f, _HEADER.size))
+    if magic != MAGIC:
+        raise ArchiveError("The file isn't a Pente game archive")
+    if version != FORMAT_VERSION:
+        raise ArchiveError(f"Unknown archive format version {version}")
+    while True:
+        record = f.read(_RECORD.size)
+        if not record:
+            return
+        if len(record) != _RECORD.size:
+            raise ArchiveError("The archive ends part of the way through a game")
+        whenSaved, winner, mode, compDifficulty, nameLength, username1Length, username2Length, gameLength = _RECORD.unpack(record)
+        name = _decode(_read(f, nameLength))
+        username1 = _decode(_read(f, username1Length)) if username1Length != _NO_PLAYER else None
+        username2 = _decode(_read(f, username2Length)) if username2Length != _NO_PLAYER else None
+        game = _read(f, gameLength)
+        try:
+            Game.fromBytes(game)
+        except GameError as e:
+            raise ArchiveError(f"The game '{name}' isn't a valid game ({e})") from e
+        try:
+            mode = Mode(mode)
+        except ValueError:
+            raise ArchiveError(f"The game '{name}' has an unknown game mode")
+        yield name, whenSaved, game, winner, mode, compDifficulty, username1, username2
+
+# Given the path of an archive (which may be compressed), adds every game in it to the database.
+# The games are added in one transaction, so if the archive isn't valid, none of its games are added. Returns the number of games imported.
+def importGames(path):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    with (gzip.open(path, "rb") if compressed else open(path, "rb")) as f:
+        return Database.addGameData(_readGames(f))
\ No newline at end of file
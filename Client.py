@@ -1,18 +1,40 @@
 import socket
-import pickle
-from ServerClientDatatypes import Msg, Cmd
+import threading
+import queue
+import time
+from ServerClientDatatypes import Msg, Cmd, MoveDelta, sendMsg, recvMsg
 
 # The Client class contains all properties and methods required by the client.
 # An instance of the Client class is created when a user wants to play Player v.s. Player LAN.
 # The client sends/receives messages from the server, which controls the interaction between clients.
+# Messages from the server are received by a background receive loop, which passes moves to a callback (or to the queue read by getMove) and replies to the reply queue, so sending a message never waits on receiving one.
+# While connected, the client sends a heartbeat to the server every heartbeat interval, which the server replies to. If nothing is received for the idle timeout, the connection is treated as dropped.
+# If the connection to the server drops during a game, the receive loop reconnects and resumes the game using its session token.
+# When connected to the router of a sharded server, the client is redirected to the worker running its game (or the game it spectates), and joins the game there by resuming it.
 class Client:
 
-    def __init__(self, username):
+    def __init__(self, username, host=None, port=8080):
+        self._RESUME_ATTEMPTS = 10
+        self._RESUME_DELAY = 2
+        self._HEARTBEAT_INTERVAL = 10
+        self._IDLE_TIMEOUT = 35
         self._username = username
+        self._host = host if host is not None else socket.gethostname()
+        self._port = port
         self._opponent = None
         self._playerNo = None
+        self._gameId = None
+        self._token = None
+        self._lastSeq = 0
+        self._lastMove = None
+        self._movesMade = 0
         self._s = None
-        self._requestingMove = False
+        self._sendLock = threading.Lock()
+        self._moveLock = threading.Lock()
+        self._replies = queue.Queue()
+        self._moves = queue.Queue()
+        self._onMove = None
+        self._closed = threading.Event()
 
     @property
     def username(self):
@@ -34,6 +56,30 @@ class Client:
     def playerNo(self, playerNo):
         self._playerNo = playerNo
 
+    @property
+    def gameId(self):
+        return self._gameId
+
+    @gameId.setter
+    def gameId(self, gameId):
+        self._gameId = gameId
+
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+
+    @property
+    def lastSeq(self):
+        return self._lastSeq
+
+    @lastSeq.setter
+    def lastSeq(self, lastSeq):
+        self._lastSeq = lastSeq
+
     @property
     def s(self):
         return self._s
@@ -42,43 +88,215 @@ class Client:
     def s(self, s):
         self._s = s
 
-    @property
-    def requestingMove(self):
-        return self._requestingMove
+    # Opens and returns a new socket connected to the server, which times out if nothing is received for the idle timeout.
+    def _connect(self):
+        s = socket.socket()
+        s.settimeout(self._IDLE_TIMEOUT)
+        try:
+            s.connect((self._host, self._port))
+        except OSError:
+            s.close()
+            raise
+        return s
 
-    @requestingMove.setter
-    def requestingMove(self, bool):
-        self._requestingMove = bool
+    # Given a newly connected socket, makes it the client's connection in place of the old one (which is closed), returning False if the client has been closed in the meantime.
+    # Must be called while holding the send lock, so that nothing is sent while the connection is being swapped.
+    def _swapConnection(self, s):
+        if self._closed.is_set():
+            s.close()
+            return False
+        oldS, self.s = self.s, s
+        oldS.close()
+        return True
 
-    # Makes a connection between the client and the server.
+    # Given a message, sends it to the server. Sends are made under a lock, so messages sent from different threads are never interleaved.
+    def _send(self, msg):
+        with self._sendLock:
+            sendMsg(self.s, msg)
+
+    # Returns the next reply from the server, waiting until it is received.
+    # Raises a ConnectionError if the connection to the server has closed.
+    def _getReply(self):
+        msg = self._replies.get()
+        if msg is None:
+            raise ConnectionError("Connection to the server closed")
+        return msg
+
+    # Makes a connection between the client and the server, and starts the receive loop and heartbeat threads.
     def makeConnection(self):
-        host = socket.gethostname()
-        port = 8080
+        self.s = self._connect()
+        threading.Thread(target=self._receive, daemon=True).start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        self._send(Msg(self.username, Cmd.ADD))
+        self._getReply()
+
+    # Run by the heartbeat thread: sends a heartbeat every heartbeat interval until the connection is closed, so that the server doesn't reap the connection of an idle client (e.g. one waiting for an opponent).
+    def _heartbeat(self):
+        while not self._closed.wait(self._HEARTBEAT_INTERVAL):
+            try:
+                self._send(Msg(self.username, Cmd.HEARTBEAT))
+            except OSError:
+                pass
+
+    # Run by the receive loop thread: receives each message from the server, passing moves to _dispatchMove and anything else (apart from heartbeats and redirects) to the reply queue.
+    # If the connection drops during a game, the game is resumed. Otherwise (or if it can't be resumed) None is passed on to show the connection has been lost.
+    def _receive(self):
+        while True:
+            try:
+                msg = recvMsg(self.s)
+            except OSError:
+                msg = None
+            if msg is None:
+                if self._closed.is_set():
+                    return
+                if self.token is not None and self._resume():
+                    continue
+                break
+            if isinstance(msg.data, MoveDelta):
+                self.lastSeq = msg.data.seq
+                self._dispatchMove(msg.data)
+            elif msg.data == Cmd.REDIRECT:
+                if not self._redirect(*msg.args):
+                    break
+            elif msg.data != Cmd.HEARTBEAT:
+                self._replies.put(msg)
+        self._closed.set()
+        self._dispatchMove(None)
+        self._replies.put(None)
+
+    # Given a MoveDelta received from the server (or None if the connection has been lost), passes it to the move callback if one is set, and adds it to the move queue otherwise.
+    # The server also sends back a MoveDelta for each of the player's own moves, which are skipped (apart from forfeits).
+    def _dispatchMove(self, delta):
+        if delta is not None and delta.player == self.playerNo and not delta.isForfeit():
+            return
+        with self._moveLock:
+            if self._onMove is not None:
+                self._onMove(delta)
+            else:
+                self._moves.put(delta)
 
-        self.s = socket.socket()
-        self.s.connect((host, port))
+    # Given a function (or None), sets the function called with each of the opponent's moves as they are received, instead of them being returned by getMove.
+    # The function is called from the receive loop thread with a MoveDelta, or None if the connection has been lost. Any moves received before the function was set are passed to it straight away.
+    def setMoveCallback(self, callback):
+        with self._moveLock:
+            self._onMove = callback
+            while callback is not None and not self._moves.empty():
+                callback(self._moves.get_nowait())
 
-        self.s.send(pickle.dumps(Msg(self.username, Cmd.ADD)))
-        data = self.s.recv(1024)
+    # Requests and receives an opponent (and the id and session token of the game session created for the game) from the server.
+    # The player's score can be given so that the server matches them with a player of a similar rank.
+    # If the server is the router of a sharded server, the reply also gives the address of the worker running the game. The connection to the router is then shut down, so that the receive loop resumes the game on the worker.
+    def getOpponent(self, score=None):
+        self._send(Msg(self.username, Cmd.GETOPP, args=score))
+        msg = self._getReply()
+        self.opponent, self.playerNo = msg.data
+        self.gameId, self.token = msg.args[:2]
+        if len(msg.args) > 2:
+            with self._sendLock:
+                self._host, self._port = msg.args[2]
+                try:
+                    self.s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
 
-    # Requests and receives an opponent from the server.
-    def getOpponent(self):
-        self.s.send(pickle.dumps(Msg(self.username, Cmd.GETOPP)))
-        self.opponent, self.playerNo = pickle.loads(self.s.recv(1024)).data
+    # Called by the receive loop when a request to spectate a game is redirected to the worker of a sharded server with the given host and port.
+    # Connects to the worker and sends the request again, returning whether this succeeded. The send lock is only held to swap the connection, so sends from other threads never wait on the connection being made.
+    def _redirect(self, host, port):
+        self._host, self._port = host, port
+        try:
+            s = self._connect()
+            sendMsg(s, Msg(self.username, Cmd.SPECTATE, args=self.gameId))
+        except OSError:
+            return False
+        with self._sendLock:
+            return self._swapConnection(s)
 
-    # Requests and receives the opponent's move from the server.
+    # Called by the receive loop when the connection has dropped: reconnects to the server and resumes the game from the last move received.
+    # The server only sends the moves that were missed. If the server never received the player's last move, it is sent again.
+    # If the server redirects the client to the worker running the game, the game is resumed there instead. Returns whether the game was resumed.
+    # The new connection is made and the game resumed on it without holding the send lock, so that moves made (and the client being closed) on other threads never wait for the reconnection.
+    # The send lock is then held to swap the connection and, if the server never received the player's last move (including one made while reconnecting), to send it again.
+    def _resume(self):
+        for _ in range(self._RESUME_ATTEMPTS):
+            if self._closed.is_set():
+                return False
+            s = None
+            try:
+                s = self._connect()
+                sendMsg(s, Msg(self.username, Cmd.RESUME, args=(self.gameId, self.token, self.lastSeq)))
+                msg = recvMsg(s)
+            except OSError:
+                msg = False
+                if s is not None:
+                    s.close()
+            if msg is False:
+                time.sleep(self._RESUME_DELAY)
+                continue
+            if msg is not None and msg.data == Cmd.REDIRECT:
+                s.close()
+                self._host, self._port = msg.args
+                continue
+            if msg is None or not isinstance(msg.data, int):
+                s.close()
+                return False
+            with self._sendLock:
+                if not self._swapConnection(s):
+                    return False
+                if msg.data < self._movesMade:
+                    try:
+                        sendMsg(self.s, Msg(self.username, self._lastMove, self.opponent))
+                    except OSError:
+                        pass
+            return True
+        return False
+
+    # Returns the opponent's next move as a MoveDelta of the changes the move made to the game, waiting until it is received.
+    # If the connection drops, the receive loop resumes the game. Raises a ConnectionError if it can't be resumed.
     def getMove(self):
-        self.requestingMove = True
-        self.s.send(pickle.dumps(Msg(self.username, Cmd.GETMOVE)))
-        move = pickle.loads(self.s.recv(1024)).data
-        self.requestingMove = False
-        return move
+        delta = self._moves.get()
+        if delta is None:
+            raise ConnectionError("Unable to resume the game")
+        return delta
 
-    # Sends the player's move to the server.
+    # Sends the player's move to the server without waiting for anything to be received.
+    # If the connection has dropped, the receive loop resumes the game and sends the move again (unless it is (-1, -1), quitting the game, as the server forfeits the game for a player that doesn't resume).
     def makeMove(self, move):
-        self.s.send(pickle.dumps(Msg(self.username, move, self.opponent)))
+        with self._sendLock:
+            if move != (-1, -1):
+                self._lastMove = move
+                self._movesMade += 1
+            try:
+                sendMsg(self.s, Msg(self.username, move, self.opponent))
+            except OSError:
+                pass
+
+    # Requests and returns a list of the games being played on the server, each given as its game id and a dictionary of the player usernames.
+    def getGames(self):
+        self._send(Msg(self.username, Cmd.GETGAMES))
+        return self._getReply().data
+
+    # Given a game id, starts spectating the game with that id, and returns a dictionary of the usernames of player 1 and player 2 (or None if there is no such game).
+    # Once spectating, the moves of the game are received by calling the getSpectatedMove function.
+    def spectate(self, gameId):
+        self.gameId = gameId
+        self._send(Msg(self.username, Cmd.SPECTATE, args=gameId))
+        msg = self._getReply()
+        self.gameId = msg.args
+        return msg.data
+
+    # Returns the next move of the game being spectated as a MoveDelta, or None once the game has ended and there are no more moves.
+    def getSpectatedMove(self):
+        return self._moves.get()
 
     # Closes the connection between the client and the server.
+    # The connection is shut down before being closed, so that the receive loop (which is blocked reading from it) stops. Closing also stops the heartbeats, and does nothing else if the client never connected.
     def closeConnection(self):
-        self.s.send(pickle.dumps(Msg(self.username, Cmd.REM)))
+        self._closed.set()
+        if self.s is None:
+            return
+        try:
+            self._send(Msg(self.username, Cmd.REM))
+            self.s.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.s.close()
\ No newline at end of file
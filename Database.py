@@ -1,11 +1,15 @@
 import sqlite3
 import pickle
 from datetime import datetime
+from contextlib import contextmanager
+import threading
+import hashlib
+import hmac
 import os
-import Ui
-from Game import Game, GameRecord
+from Game import Game, GameRecord, Player
 
 # The HashTable class enables usernames to be stored at indexes determined by their passwords in a table.
+# Passwords are now stored in the Credential table; the hash table is only used to move the passwords of databases made by older versions of the program into it.
 class HashTable:
 
     def __init__(self):
@@ -29,44 +33,95 @@ class HashTable:
         passwordHash = self.__hashFunction(password)
         return username in self._hashTable[passwordHash]
 
+    # Given a password, returns the index of the table that usernames with the password are stored at.
+    def getIndex(self, password):
+        return self.__hashFunction(password)
+
+    # Returns a list of every username stored in the hash table, each given with the index it is stored at.
+    def getEntries(self):
+        return [(username, index) for index, usernames in enumerate(self._hashTable) for username in usernames]
+
+# Given a datetime, returns it as a timestamp: the whole number of seconds since the epoch, which is how times are stored in the database.
+def toTimestamp(whenSaved):
+    return int(whenSaved.timestamp())
+
+# Given a timestamp stored in the database, returns it as a datetime.
+def fromTimestamp(timestamp):
+    return datetime.fromtimestamp(timestamp)
+
 # Returns if the database exists.
 def exists():
     return os.path.exists("PenteDatabase.db")
 
-# Connects with the database via the sqlite3 connect function.
-def connect():
-    conn = sqlite3.connect("PenteDatabase.db")
-    c = conn.cursor()
-    return conn, c
-
-# Closes the connection with the database and commits the last made changes.
-def close(conn):
-    conn.commit()
-    conn.close()
+# Each thread keeps its own long-lived connection to the database, along with how deeply nested the transaction it is running is.
+_local = threading.local()
 
-# Creates a new database.
+# Returns the calling thread's connection to the database, opening it the first time the thread uses the database.
+# The connection is in autocommit mode, so writes are grouped with the transaction function. The database uses write-ahead logging, which lets the database be read while it is being written to, and with synchronous set to NORMAL it is only synced to disk at checkpoints rather than on every commit.
+def connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect("PenteDatabase.db", timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA cache_size = -8000;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        _local.conn = conn
+        _local.depth = 0
+    return conn
+
+# Closes the calling thread's connection with the database (if it has one).
+def close():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# A context manager which runs the statements inside it as a single transaction, which is committed at the end (or rolled back if an exception is raised).
+# Transactions can be nested, in which case only the outermost one begins and commits, so the caller of functions which write to the database can group their writes into one transaction.
+@contextmanager
+def transaction():
+    conn = connect()
+    if _local.depth == 0:
+        conn.execute("BEGIN IMMEDIATE;")
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.rollback()
+        raise
+    _local.depth -= 1
+    if _local.depth == 0:
+        conn.commit()
+
+# Creates a new database with the current schema, and records every migration as having been run so that migrate only changes databases made by older versions of the program.
 def createDatabase():
     playerSQL = """
     CREATE TABLE Player(
     username TEXT PRIMARY KEY,
-    whenSaved BLOB NOT NULL,
+    whenSaved INTEGER NOT NULL,
     numberOfWins INTEGER NOT NULL,
     numberOfLosses INTEGER NOT NULL,
     numberOfDraws INTEGER NOT NULL,
     score INTEGER NOT NULL
     );"""
 
-    hashtableSQL = """
-    CREATE TABLE HashTable(
-    id INTEGER PRIMARY KEY,
-    hashTable BLOB NOT NULL
+    credentialSQL = """
+    CREATE TABLE Credential(
+    username TEXT PRIMARY KEY,
+    salt BLOB,
+    passwordHash BLOB,
+    iterations INTEGER,
+    legacyHash INTEGER
     );"""
 
     gameSQL = """
     CREATE TABLE Game(
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
-	whenSaved BLOB NOT NULL,
+	whenSaved INTEGER NOT NULL,
 	game BLOB NOT NULL,
     winner INTEGER NOT NULL,
     mode BLOB NOT NULL,
@@ -78,81 +133,211 @@ def createDatabase():
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT NOT NULL,
     gameId INTEGER NOT NULL,
-    playerNo INTEGER NOT NULL
+    playerNo INTEGER NOT NULL,
+    whenSaved INTEGER NOT NULL
     );"""
 
-    conn, c = connect()
-    tableSQLDict = {"Player": playerSQL, "HashTable": hashtableSQL, "Game": gameSQL, "PlayerGame": playergameSQL}
-    for tableName, sql in tableSQLDict.items():
-        c.execute(sql)
-        if tableName == "HashTable":
-            hashtable = pickle.dumps(HashTable())
-            recordSQL = """
-            INSERT INTO HashTable(id, hashTable)
-            VALUES(1, ?);
-            """
-            editTable(recordSQL, (hashtable,))
-    close(conn)
+    with transaction() as conn:
+        for sql in [playerSQL, credentialSQL, gameSQL, playergameSQL]:
+            conn.execute(sql)
+        _addIndexes(conn)
+        _addScoreIndex(conn)
+        _addPlayerGameWhenSavedIndex(conn)
+        conn.execute(f"PRAGMA user_version = {len(_MIGRATIONS)};")
+
+# Adds the indexes used to look up the games of a player (and the players of a game) in the PlayerGame table, and to filter and order games in the Game table.
+def _addIndexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS PlayerGameUsernameIndex ON PlayerGame(username, gameId);")
+    conn.execute("CREATE INDEX IF NOT EXISTS PlayerGameGameIdIndex ON PlayerGame(gameId, playerNo);")
+    conn.execute("CREATE INDEX IF NOT EXISTS GameWinnerIndex ON Game(winner);")
+    conn.execute("CREATE INDEX IF NOT EXISTS GameWhenSavedIndex ON Game(whenSaved);")
+
+# Converts every game in the Game table which is stored as a pickled Game object into the compact bytes made by the game's toBytes function.
+def _packGames(conn):
+    for id, game in conn.execute("SELECT id, game FROM Game;").fetchall():
+        conn.execute("UPDATE Game SET game = ? WHERE id = ?;", (pickle.loads(game).toBytes(), id))
+
+# Adds the index used to rank players by score, which orders players from the highest score to the lowest (and by username amongst players with the same score).
+def _addScoreIndex(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS PlayerScoreIndex ON Player(score DESC, username);")
+
+# Moves the passwords stored in the hash table into the Credential table, which stores each player's password as a salted hash in its own row, and removes the HashTable table.
+# The passwords themselves can't be recovered from the hash table, so each player's hash table index is kept as their legacy hash until they next log in, when their password is hashed properly by checkPassword.
+def _addCredentials(conn):
+    conn.execute("""
+    CREATE TABLE Credential(
+    username TEXT PRIMARY KEY,
+    salt BLOB,
+    passwordHash BLOB,
+    iterations INTEGER,
+    legacyHash INTEGER
+    );""")
+    [hashtable] = conn.execute("SELECT hashTable FROM HashTable WHERE id = 1;").fetchone()
+    for username, index in pickle.loads(hashtable).getEntries():
+        conn.execute("INSERT OR IGNORE INTO Credential(username, legacyHash) VALUES(?, ?);", (username, index))
+    conn.execute("DROP TABLE HashTable;")
+
+# Converts the whenSaved columns of the Player and Game tables from pickled datetimes into timestamps, so that times can be ordered and compared by SQLite.
+# SQLite can't change the type of a column, so each table is rebuilt: a new table is made, the rows are copied into it (converting each whenSaved), and it replaces the old table, after which the old table's indexes are made again.
+def _convertTimestamps(conn):
+    conn.create_function("pickleToTimestamp", 1, lambda whenSaved: toTimestamp(pickle.loads(whenSaved)), deterministic=True)
+    [nextGameId] = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Game';").fetchone() or [0]
+    conn.execute("""
+    CREATE TABLE NewPlayer(
+    username TEXT PRIMARY KEY,
+    whenSaved INTEGER NOT NULL,
+    numberOfWins INTEGER NOT NULL,
+    numberOfLosses INTEGER NOT NULL,
+    numberOfDraws INTEGER NOT NULL,
+    score INTEGER NOT NULL
+    );""")
+    conn.execute("""
+    INSERT INTO NewPlayer(username, whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score)
+    SELECT username, pickleToTimestamp(whenSaved), numberOfWins, numberOfLosses, numberOfDraws, score
+    FROM Player;
+    """)
+    conn.execute("""
+    CREATE TABLE NewGame(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    whenSaved INTEGER NOT NULL,
+    game BLOB NOT NULL,
+    winner INTEGER NOT NULL,
+    mode BLOB NOT NULL,
+    compDifficulty INTEGER NOT NULL
+    );""")
+    conn.execute("""
+    INSERT INTO NewGame(id, name, whenSaved, game, winner, mode, compDifficulty)
+    SELECT id, name, pickleToTimestamp(whenSaved), game, winner, mode, compDifficulty
+    FROM Game;
+    """)
+    for table in ["Player", "Game"]:
+        conn.execute(f"DROP TABLE {table};")
+        conn.execute(f"ALTER TABLE New{table} RENAME TO {table};")
+    conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Game';", (nextGameId,))
+    _addIndexes(conn)
+    _addScoreIndex(conn)
+
+# Adds the index used to look up the games of a player from the most recently saved, which orders each player's games in the PlayerGame table by when they were saved (and by game id amongst games saved at the same time).
+def _addPlayerGameWhenSavedIndex(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS PlayerGameWhenSavedIndex ON PlayerGame(username, whenSaved, gameId);")
+
+# Adds a copy of each game's whenSaved to the PlayerGame table, so that a player's games can be ordered by when they were saved using the PlayerGame table's index rather than by sorting them.
+# The copy is filled in from the Game table, and is kept up to date by saveGame, updateGame and addGameData.
+def _addPlayerGameWhenSaved(conn):
+    conn.execute("ALTER TABLE PlayerGame ADD COLUMN whenSaved INTEGER NOT NULL DEFAULT 0;")
+    conn.execute("UPDATE PlayerGame SET whenSaved = COALESCE((SELECT whenSaved FROM Game WHERE Game.id = PlayerGame.gameId), 0);")
+    _addPlayerGameWhenSavedIndex(conn)
+
+# The migrations which bring the schema of a database up to date, in the order they are run. Each is a function which is given the connection to the database.
+# The user_version of a database is the number of migrations which have been run on it.
+_MIGRATIONS = [_addIndexes, _packGames, _addScoreIndex, _addCredentials, _convertTimestamps, _addPlayerGameWhenSaved]
+
+# Runs each migration which hasn't yet been run on the database, each in its own transaction along with the update of the database's user_version.
+# Called every time the program is run, so that databases created by older versions of the program are brought up to date.
+def migrate():
+    version = getRecords("PRAGMA user_version;")[0][0]
+    for number, migration in enumerate(_MIGRATIONS[version:], version+1):
+        with transaction() as conn:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number};")
+
+# The Rollback exception is raised to roll back the transaction in which checkQueryPlans runs the queries it checks.
+class _Rollback(Exception):
+    pass
+
+# Runs each query used to look up games and players (inside a transaction which is rolled back, so nothing is changed), and asks SQLite for the plan of each statement run.
+# Returns a list of the statements which scan a whole table instead of using an index (or sort their results instead of reading them in order from an index), each given with the step of the plan which does so. An empty list means every query uses an index.
+def checkQueryPlans():
+    conn = connect()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        with transaction():
+            loadGames("", Game.P1)
+            loadAllGames("")
+            loadGamesPage("", after=GameRecord(id=0, whenSaved=datetime.now()))
+            countGames("", Game.P1)
+            getPlayerGameUsername(0, Game.P1)
+            getPlayerRank("")
+            getLeaderboard(after=(1, "", 0))
+            checkPassword("", "")
+            deleteGame(0)
+            raise _Rollback()
+    except _Rollback:
+        pass
+    finally:
+        conn.set_trace_callback(None)
+    scans = []
+    for statement in statements:
+        if statement.split()[0].upper() not in ["SELECT", "UPDATE", "DELETE"]:
+            continue
+        for row in conn.execute("EXPLAIN QUERY PLAN " + statement):
+            if (row[-1].startswith("SCAN") and "CONSTANT ROW" not in row[-1]) or row[-1].startswith("USE TEMP B-TREE"):
+                scans.append((" ".join(statement.split()), row[-1]))
+    return scans
 
 # The SQL, values to be used in the SQL, and whether the id of the last row added is required to be returned is passed in as parameters.
-# THe SQL is executed with the values, and if the id of the last row is required, this is returned. Otherwise, nothing is returned.
+# THe SQL is executed with the values (in a transaction, unless it is part of a larger one), and if the id of the last row is required, this is returned. Otherwise, nothing is returned.
 def editTable(recordSQL, values, getId=False):
-    conn, c = connect()
-    c.execute(recordSQL, values)
-    if getId:
-        id = c.lastrowid
-    else:
-        id = None
-    close(conn)
+    with transaction() as conn:
+        c = conn.execute(recordSQL, values)
+        if getId:
+            id = c.lastrowid
+        else:
+            id = None
     return id
 
 # Given a recordQuery (written in SQL) and values to be used in the SQL, the getRecords function returns the records specified by the recordQuery.
 def getRecords(recordQuery, values=()):
-    conn, c = connect()
-    c.execute(recordQuery, values)
-    res = c.fetchall()
-    close(conn)
-    return res
-
-# Loads the hash table from the database and returns it.
-def loadHashTable():
-    recordQuery = """
-    SELECT hashtable
-    FROM HashTable
-    WHERE id = 1;
-    """
-    [hashtable] = getRecords(recordQuery, ())[0]
-    return pickle.loads(hashtable)
-
-# Given a hash table, the saveHashTable function updates the existing hash table in the database with the new one.
-def saveHashTable(hashtable):
-    updateQuery = f"""
-    UPDATE HashTable
-    SET hashTable = ?
-    WHERE id = 1;
-    """
-    editTable(updateQuery, (pickle.dumps(hashtable),))
+    return connect().execute(recordQuery, values).fetchall()
+
+# The number of iterations of PBKDF2 used to hash new passwords. The number used for each password is stored with it, so this can be raised without breaking existing passwords.
+# It is chosen so that hashing a password takes around a tenth of a second, which makes guessing passwords from a copied database slow while logging in still feels instant. The GUI hashes passwords on its database writer thread, so the time isn't spent on the Tkinter main loop.
+PBKDF2_ITERATIONS = 200000
 
-# Given a username and password, returns whether there is such a match found in the hash table stored in the database.
+# Given a password, a salt, and a number of iterations, returns the hash of the password made by PBKDF2 (with SHA-256).
+def hashPassword(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+# Given a username and password, returns whether the password is the player's password by looking up the player's row in the Credential table.
+# If the player's password is only stored as a legacy hash (from the hash table of an older version of the program) and matches it, the password is hashed properly and stored in its place.
 def checkPassword(username, password):
-    hashtable = loadHashTable()
-    return hashtable.isInTable(username, password)
+    recordSQL = """
+    SELECT salt, passwordHash, iterations, legacyHash
+    FROM Credential
+    WHERE username = ?;
+    """
+    records = getRecords(recordSQL, (username,))
+    if not records:
+        return False
+    salt, passwordHash, iterations, legacyHash = records[0]
+    if passwordHash is not None:
+        return hmac.compare_digest(hashPassword(password, salt, iterations), passwordHash)
+    if legacyHash != HashTable().getIndex(password):
+        return False
+    addPassword(username, password)
+    return True
 
-# Given a username and password, the function loads the hash table from the database, adds the new match to the table, and saves it back to the database.
+# Given a username and password, stores a salted hash of the password as the player's password in the Credential table (replacing any password the player already had).
 def addPassword(username, password):
-    hashtable = loadHashTable()
-    hashtable.addToTable(username, password)
-    saveHashTable(hashtable)
+    salt = os.urandom(16)
+    recordSQL = """
+    INSERT OR REPLACE INTO Credential(username, salt, passwordHash, iterations, legacyHash)
+    VALUES(?, ?, ?, ?, NULL);
+    """
+    editTable(recordSQL, (username, salt, hashPassword(password, salt, PBKDF2_ITERATIONS), PBKDF2_ITERATIONS))
 
-# Given a username, password, and whenSaved (the datetime the account was created) the username and password is added to the hash table, and a new Player entry is made in the database's Player table.
+# Given a username, password, and whenSaved (the datetime the account was created) the player's password is added to the Credential table, and a new Player entry is made in the database's Player table.
 def savePlayer(username, password, whenSaved):
-    addPassword(username, password)
-    whenSaved = pickle.dumps(whenSaved)
+    whenSaved = toTimestamp(whenSaved)
     recordSQL = """
     INSERT INTO Player(username, whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score)
     VALUES(?, ?, 0, 0, 0, 0);
     """
-    editTable(recordSQL, (username, whenSaved))
+    with transaction():
+        addPassword(username, password)
+        editTable(recordSQL, (username, whenSaved))
 
 # Given a username, the details of the Player entry specified by username is returned from the function.
 def getPlayer(username):
@@ -162,10 +347,11 @@ def getPlayer(username):
     WHERE username = ?;
     """
     whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score = getRecords(recordSQL, (username,))[0]
-    whenSaved = pickle.loads(whenSaved)
+    whenSaved = fromTimestamp(whenSaved)
     return [whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score]
 
 # Adds a game result to the player's profile, and updates the player's score depending on the result.
+# The result is added by a single UPDATE which increments the counters in place, so results being recorded at the same time can't overwrite each other.
 def addPlayerResult(username, didWin):
     if didWin == True:
         field = "numberOfWins"
@@ -176,28 +362,69 @@ def addPlayerResult(username, didWin):
     else:
         field = "numberOfDraws"
         scoreAdd = 3
-    selectSQL = f"""
-    SELECT {field}, score
-    FROM Player
-    WHERE username = ?;
-    """
     updateSQL = f"""
     UPDATE Player
-    SET {field} = ?, score = ?
+    SET {field} = {field} + 1, score = score + ?
     WHERE username = ?;
     """
-    num, score = getRecords(selectSQL, (username,))[0]
-    editTable(updateSQL, (num+1, score+scoreAdd, username))
-
-# Returns the specified player's rank by score amongst other players.
+    editTable(updateSQL, (scoreAdd, username))
+
+# Given a list of results of a game, each given as a username and whether the player won (as for addPlayerResult), and the game record if it is a saved game, records the result of the game.
+# Every player's result and the update of the saved game are written in one transaction, so they are committed together.
+def recordGameResult(results, gameRecord=None):
+    with transaction():
+        for username, didWin in results:
+            addPlayerResult(username, didWin)
+        if gameRecord is not None:
+            updateGame(gameRecord)
+
+# Returns the specified player's rank by score amongst other players: one more than the number of players with a higher score, so players with the same score have the same rank.
+# The players with a higher score are counted from the score index, so the other players don't need to be read.
 def getPlayerRank(username):
     recordSQL = """
-    SELECT username
+    SELECT COUNT(*) + 1
     FROM Player
-    ORDER BY score DESC;
+    WHERE score > (SELECT score FROM Player WHERE username = ?);
+    """
+    return getRecords(recordSQL, (username,))[0][0]
+
+# Given the last entry of the previous page of the leaderboard (or None for the first page) and the number of players on each page, returns the next page of the leaderboard.
+# The leaderboard lists players from the highest score to the lowest (and by username amongst players with the same score), each given as their rank (as for getPlayerRank), username, and score.
+# The page is looked up from where the previous page ended using the score index, rather than by ranking every player. The rank of the first player on the page is counted as getPlayerRank does, along with the players with the same score before them, from which the ranks of the rest of the page follow.
+def getLeaderboard(after=None, pageSize=10):
+    if after is None:
+        recordSQL = """
+        SELECT username, score
+        FROM Player
+        ORDER BY score DESC, username
+        LIMIT ?;
+        """
+        players = getRecords(recordSQL, (pageSize,))
+    else:
+        _, username, score = after
+        recordSQL = """
+        SELECT username, score
+        FROM Player
+        WHERE score <= ? AND (score < ? OR username > ?)
+        ORDER BY score DESC, username
+        LIMIT ?;
+        """
+        players = getRecords(recordSQL, (score, score, username, pageSize))
+    if not players:
+        return []
+    countSQL = """
+    SELECT (SELECT COUNT(*) FROM Player WHERE score > ?), (SELECT COUNT(*) FROM Player WHERE score = ? AND username < ?);
     """
-    playerUsernames = getRecords(recordSQL)
-    return playerUsernames.index((username,))+1
+    firstUsername, firstScore = players[0]
+    higherScores, sameScoreBefore = getRecords(countSQL, (firstScore, firstScore, firstUsername))[0]
+    leaderboard = []
+    for position, (username, score) in enumerate(players):
+        if position == 0:
+            rank = higherScores + 1
+        elif score != players[position-1][1]:
+            rank = higherScores + sameScoreBefore + position + 1
+        leaderboard.append((rank, username, score))
+    return leaderboard
 
 # Given a username, the function returns if there are any existing Player entries in the Player table with that username.
 def isUniqueUsername(username):
@@ -213,8 +440,8 @@ def isUniqueUsername(username):
 # The function returns the game id of the game that it has saved
 def saveGame(username1, username2, gameRecord):
     name = gameRecord.name
-    whenSaved = pickle.dumps(gameRecord.whenSaved)
-    game = pickle.dumps(gameRecord.game)
+    whenSaved = toTimestamp(gameRecord.whenSaved)
+    game = gameRecord.game.toBytes()
     winner = gameRecord.game.winner
     mode = pickle.dumps(gameRecord.mode)
     compDifficulty = gameRecord.compDifficulty
@@ -224,82 +451,156 @@ def saveGame(username1, username2, gameRecord):
     VALUES(?, ?, ?, ?, ?, ?);
     """
     
-    gameId = editTable(recordSQL, (name, whenSaved, game, winner, mode, compDifficulty), getId=True)
-
-    invalidUsernames = [Ui.Player.GUEST, Ui.Player.COMP]
-    if username1 not in invalidUsernames:
-        savePlayerGame(username1, gameId, Game.P1)
-    if username2 not in invalidUsernames:
-        savePlayerGame(username2, gameId, Game.P2)
+    with transaction():
+        gameId = editTable(recordSQL, (name, whenSaved, game, winner, mode, compDifficulty), getId=True)
+
+        invalidUsernames = [Player.GUEST, Player.COMP]
+        if username1 not in invalidUsernames:
+            savePlayerGame(username1, gameId, Game.P1, whenSaved)
+        if username2 not in invalidUsernames:
+            savePlayerGame(username2, gameId, Game.P2, whenSaved)
     
     return gameId
 
-# Given a game record, updates the game with the same id in the Game table with the new game information.
+# Given a game record, updates the game with the same id in the Game table with the new game information, along with the copy of its whenSaved in the PlayerGame table (in one transaction).
 def updateGame(gameRecord):
-    whenSaved = pickle.dumps(gameRecord.whenSaved)
-    game = pickle.dumps(gameRecord.game)
+    whenSaved = toTimestamp(gameRecord.whenSaved)
+    game = gameRecord.game.toBytes()
     winner = gameRecord.game.winner
     id = gameRecord.id
-    recordSQL = """
-    UPDATE Game
-    SET whenSaved = ?, game = ?, winner = ?
-    WHERE id = ?;
-    """
-    editTable(recordSQL, (whenSaved, game, winner, id))
+    with transaction():
+        recordSQL = """
+        UPDATE Game
+        SET whenSaved = ?, game = ?, winner = ?
+        WHERE id = ?;
+        """
+        editTable(recordSQL, (whenSaved, game, winner, id))
+
+        recordSQL = """
+        UPDATE PlayerGame
+        SET whenSaved = ?
+        WHERE gameId = ?;
+        """
+        editTable(recordSQL, (whenSaved, id))
+
+# The SQL joined onto the Game table by the queries which return games, so that the usernames of player 1 and player 2 of each game are returned in the same query.
+# Each username is NULL if that player wasn't logged in (or was the computer).
+_PLAYERS_JOIN_SQL = """
+    LEFT JOIN PlayerGame AS Player1 ON Player1.gameId = Game.id AND Player1.playerNo = ?
+    LEFT JOIN PlayerGame AS Player2 ON Player2.gameId = Game.id AND Player2.playerNo = ?
+"""
+
+# Given the usernames of player 1 and player 2 of a game returned by a query, returns them as a list, where a player who had no username is given as False.
+def parsePlayers(username1, username2):
+    return [username if username is not None else False for username in [username1, username2]]
 
 # Given a list of game details, the function converts each game detail into its correct format, before returning them all as part of a single game record.
 def parseGames(games):
     parsedGames = []
     for game in games:
-        g = list(game) # [id, name, whenSaved, game, winner, mode, compDifficulty]
-        g[2] = pickle.loads(g[2]) # whenSaved
-        g[3] = pickle.loads(g[3]) # game
+        g = list(game) # [id, name, whenSaved, game, winner, mode, compDifficulty, username1, username2]
+        g[2] = fromTimestamp(g[2]) # whenSaved
+        g[3] = Game.fromBytes(g[3]) # game
         g[5] = pickle.loads(g[5]) # mode
-        gameRecord = GameRecord(g[0], g[1], g[2], g[3], g[5], g[6])
+        gameRecord = GameRecord(g[0], g[1], g[2], g[3], g[5], g[6], g[4], parsePlayers(g[7], g[8]))
+        parsedGames.append(gameRecord)
+    return parsedGames
+
+# Given a list of game summaries (which don't include the game itself), converts each into a game record whose game is None.
+# The full game of a summary can be loaded when it is needed by calling getGame with its id.
+def parseGameSummaries(games):
+    parsedGames = []
+    for game in games:
+        g = list(game) # [id, name, whenSaved, winner, mode, compDifficulty, username1, username2]
+        g[2] = fromTimestamp(g[2]) # whenSaved
+        g[4] = pickle.loads(g[4]) # mode
+        gameRecord = GameRecord(g[0], g[1], g[2], None, g[4], g[5], g[3], parsePlayers(g[6], g[7]))
         parsedGames.append(gameRecord)
     return parsedGames
         
-# Given a username and a winner, the function returns all games which were played by the player with the username and had the specified winner.
-def loadGames(username, winner):
-    recordSQL = """
-    SELECT Game.id, Game.name, Game.whenSaved, Game.game, Game.winner, Game.mode, Game.compDifficulty
-    FROM Game
-    INNER JOIN PlayerGame ON PlayerGame.gameId = Game.id
-    WHERE PlayerGame.username = ? AND Game.winner = ?
-    ORDER BY Game.whenSaved DESC;
+# Given a username, a winner (or None for games with any winner), and a game record (or None), returns the SQL and values of the query for the summaries of the games played by the player with the username, along with the usernames of both players of each game.
+# Games are ordered from the most recently saved (and by id amongst games saved at the same time). If a game record is given, only the games after it in this order are returned, so that pages of games can be looked up from the last game of the previous page.
+# The games are ordered by the player's rows in the PlayerGame table, so they are read in order from its whenSaved index instead of being sorted.
+def _gameSummariesQuery(username, winner=None, after=None):
+    conditions = ["PlayerGame.username = ?"]
+    values = [Game.P1, Game.P2, username]
+    if winner is not None:
+        conditions.append("Game.winner = ?")
+        values.append(winner)
+    if after is not None:
+        conditions.append("(PlayerGame.whenSaved, PlayerGame.gameId) < (?, ?)")
+        values += [toTimestamp(after.whenSaved), after.id]
+    recordSQL = f"""
+    SELECT Game.id, Game.name, Game.whenSaved, Game.winner, Game.mode, Game.compDifficulty, Player1.username, Player2.username
+    FROM PlayerGame
+    INNER JOIN Game ON Game.id = PlayerGame.gameId
+    {_PLAYERS_JOIN_SQL}
+    WHERE {" AND ".join(conditions)}
+    ORDER BY PlayerGame.whenSaved DESC, PlayerGame.gameId DESC
     """
-    games = getRecords(recordSQL, (username, winner))
-    return parseGames(games)
+    return recordSQL, values
 
-# Given a username, returns all the games that were played by the player with the username.
+# Given a username and a winner, the function returns summaries of all games which were played by the player with the username and had the specified winner, along with the usernames of both players of each game.
+def loadGames(username, winner):
+    recordSQL, values = _gameSummariesQuery(username, winner)
+    games = getRecords(recordSQL, values)
+    return parseGameSummaries(games)
+
+# Given a username, returns summaries of all the games that were played by the player with the username, along with the usernames of both players of each game.
 def loadAllGames(username):
+    recordSQL, values = _gameSummariesQuery(username)
+    games = getRecords(recordSQL, values)
+    return parseGameSummaries(games)
+
+# Given a username, a winner (or None for games with any winner), the last game record of the previous page (or None for the first page), and the number of games on each page, returns the next page of summaries of the player's games.
+# The page is looked up from where the previous page ended rather than by counting past the earlier pages, so every page takes the same time to load. An empty list means there are no more games.
+def loadGamesPage(username, winner=None, after=None, pageSize=20):
+    recordSQL, values = _gameSummariesQuery(username, winner, after)
+    games = getRecords(recordSQL + "LIMIT ?;", values + [pageSize])
+    return parseGameSummaries(games)
+
+# Given a username, a winner (or None for games with any winner), and a batch size, yields the summaries of the player's games one at a time, in the same order as loadAllGames.
+# The games are fetched from the cursor in batches as they are needed, so the summaries of all the games are never held in memory at once.
+def streamGames(username, winner=None, batchSize=100):
+    recordSQL, values = _gameSummariesQuery(username, winner)
+    cursor = connect().execute(recordSQL, values)
+    try:
+        while True:
+            games = cursor.fetchmany(batchSize)
+            if not games:
+                return
+            yield from parseGameSummaries(games)
+    finally:
+        cursor.close()
+
+# Given a username and a winner (or None for games with any winner), returns the number of games played by the player with the username which had the specified winner.
+def countGames(username, winner=None):
     recordSQL = """
-    SELECT Game.id, Game.name, Game.whenSaved, Game.game, Game.winner, Game.mode, Game.compDifficulty
-    FROM Game
-    INNER JOIN PlayerGame ON PlayerGame.gameId = Game.id
-    WHERE PlayerGame.username = ?
-    ORDER BY Game.whenSaved DESC;
+    SELECT COUNT(*)
+    FROM PlayerGame
+    INNER JOIN Game ON Game.id = PlayerGame.gameId
+    WHERE PlayerGame.username = ? AND (? IS NULL OR Game.winner = ?);
     """
-    games = getRecords(recordSQL, (username,))
-    return parseGames(games)
+    return getRecords(recordSQL, (username, winner, winner))[0][0]
 
-# Given an id of a game, returns the information of the game stored in the Game table with that id.
+# Given an id of a game, returns the information of the game stored in the Game table with that id, including the full game and the usernames of its players.
 def getGame(id):
-    recordSQL = """
-    SELECT Game.id, Game.name, Game.whenSaved, Game.game, Game.winner, Game.mode, Game.compDifficulty
+    recordSQL = f"""
+    SELECT Game.id, Game.name, Game.whenSaved, Game.game, Game.winner, Game.mode, Game.compDifficulty, Player1.username, Player2.username
     FROM Game
-    WHERE id = ?;
+    {_PLAYERS_JOIN_SQL}
+    WHERE Game.id = ?;
     """
-    game = getRecords(recordSQL, (id,))
+    game = getRecords(recordSQL, (Game.P1, Game.P2, id))
     return parseGames(game)[0]
 
-# Given a username, game id, and a player number, the savePlayerGame creates a new entry in the PlayerGame table which relates a Player entry to a Game entry, and also which player number the player played as in the game.
-def savePlayerGame(username, gameId, playerNo):
+# Given a username, game id, a player number, and the timestamp the game was saved, the savePlayerGame creates a new entry in the PlayerGame table which relates a Player entry to a Game entry, and also which player number the player played as in the game.
+def savePlayerGame(username, gameId, playerNo, whenSaved):
     recordSQL = """
-    INSERT INTO PlayerGame(username, gameId, playerNo)
-    VALUES(?, ?, ?)
+    INSERT INTO PlayerGame(username, gameId, playerNo, whenSaved)
+    VALUES(?, ?, ?, ?)
     """
-    editTable(recordSQL, (username, gameId, playerNo))
+    editTable(recordSQL, (username, gameId, playerNo, whenSaved))
 
 # Given a game id and a player number, returns the username of the player who played as that player number in that game.
 def getPlayerGameUsername(gameId, playerNo):
@@ -313,16 +614,56 @@ def getPlayerGameUsername(gameId, playerNo):
         return False
     return records[0][0]
 
-# Given a game id, the function deletes the game with that game id from the Game table, along with any related PlayerGame entries.
+# Given a game id, the function deletes the game with that game id from the Game table, along with any related PlayerGame entries (in one transaction).
 def deleteGame(gameId):
-    recordSQL = """
-    DELETE FROM Game
-    WHERE Game.id = ?;
+    with transaction():
+        recordSQL = """
+        DELETE FROM Game
+        WHERE Game.id = ?;
+        """
+        editTable(recordSQL, (gameId,))
+
+        recordSQL = """
+        DELETE FROM PlayerGame
+        WHERE PlayerGame.gameId = ?;
+        """
+        editTable(recordSQL, (gameId,))
+
+# Given a username (or None for every game), yields the stored details of every game played by the player, in the order the games were first saved.
+# Each game is given as its name, saved timestamp, packed game (left as the bytes it is stored as), winner, mode, computer difficulty, and the usernames of player 1 and 2 (each None if there wasn't one).
+# The games are fetched from the cursor in batches as they are needed, so every game in the database can be copied without all of them being loaded at once.
+def streamGameData(username=None, batchSize=500):
+    recordSQL = f"""
+    SELECT Game.name, Game.whenSaved, Game.game, Game.winner, Game.mode, Game.compDifficulty, Player1.username, Player2.username
+    FROM Game
+    {_PLAYERS_JOIN_SQL}
+    WHERE ? IS NULL OR Game.id IN (SELECT gameId FROM PlayerGame WHERE username = ?)
+    ORDER BY Game.id;
     """
-    editTable(recordSQL, (gameId,))
-
+    cursor = connect().execute(recordSQL, (Game.P1, Game.P2, username, username))
+    try:
+        while True:
+            games = cursor.fetchmany(batchSize)
+            if not games:
+                return
+            for name, whenSaved, game, winner, mode, compDifficulty, username1, username2 in games:
+                yield name, whenSaved, game, winner, pickle.loads(mode), compDifficulty, username1, username2
+    finally:
+        cursor.close()
+
+# Given an iterable of the stored details of games (as yielded by streamGameData), adds each game to the Game table and relates it to its players in the PlayerGame table.
+# The games are added one at a time as they are taken from the iterable, all in one transaction, so either every game is added or none are. Returns the number of games added.
+def addGameData(games):
     recordSQL = """
-    DELETE FROM PlayerGame
-    WHERE PlayerGame.gameId = ?;
+    INSERT INTO Game(name, whenSaved, game, winner, mode, compDifficulty)
+    VALUES(?, ?, ?, ?, ?, ?);
     """
-    editTable(recordSQL, (gameId,))
\ No newline at end of file
+    numberOfGames = 0
+    with transaction():
+        for name, whenSaved, game, winner, mode, compDifficulty, username1, username2 in games:
+            gameId = editTable(recordSQL, (name, whenSaved, game, winner, pickle.dumps(mode), compDifficulty), getId=True)
+            for username, playerNo in [(username1, Game.P1), (username2, Game.P2)]:
+                if username is not None:
+                    savePlayerGame(username, gameId, playerNo, whenSaved)
+            numberOfGames += 1
+    return numberOfGames
\ No newline at end of file
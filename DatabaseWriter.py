@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from functools import partial
+from itertools import count
+import threading
+import Database
+
+# The DatabaseWriter class runs writes to the database on a thread of its own, so that the GUI doesn't freeze while they are being committed.
+# Writes are run one at a time in the order they are submitted. A write given a key replaces any write with the same key which hasn't started yet, so a write which is repeated before it has run (such as saving the same game again) is only run once.
+# Once a write has been run, its callbacks are given its result and passed to the scheduler, which the GUI uses to run them on the Tkinter main loop. If the write raises an error, its error callbacks are given the error instead.
+# Reads which need to see the writes queued before them are queued in the same way, and their results are given to their callbacks.
+class DatabaseWriter:
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._writes = OrderedDict()
+        self._writeNumbers = count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Given a function which writes to the database and the arguments to call it with, adds the write to the queue.
+    # If a key is given, any queued write with the same key is replaced by this one (and its callbacks are run once this one has been run). The callback, if given, is run with the result of the function.
+    # The onError callback, if given, is run with the error raised by the function if it fails.
+    def submit(self, function, *args, key=None, callback=None, onError=None):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The database writer has been closed")
+            if key is None:
+                key = ("write", next(self._writeNumbers))
+            callbacks, errorCallbacks = self._writes.pop(key)[2:] if key in self._writes else ([], [])
+            if callback is not None:
+                callbacks.append(callback)
+            if onError is not None:
+                errorCallbacks.append(onError)
+            self._writes[key] = (function, args, callbacks, errorCallbacks)
+            self._condition.notify_all()
+
+    # Runs every write which is still queued and then stops the writer thread. Called when the GUI is closed, so no writes are lost.
+    # The callbacks of the remaining writes aren't run, as the main loop they would be run on has stopped.
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._scheduler = None
+            self._condition.notify_all()
+        self._thread.join()
+
+    # Run by the writer thread: runs each write as it is queued, and passes its callbacks (or its error callbacks, if it failed) to the scheduler once it has been run.
+    # The thread closes its connection to the database once the writer has been closed and every write has been run.
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._writes and not self._closed:
+                    self._condition.wait()
+                if not self._writes:
+                    break
+                _, (function, args, callbacks, errorCallbacks) = self._writes.popitem(last=False)
+            try:
+                result = function(*args)
+            except Exception as e:
+                print(f"Unable to write to the database: {e!r}")
+                for onError in errorCallbacks:
+                    self._schedule(partial(onError, e))
+            else:
+                for callback in callbacks:
+                    self._schedule(partial(callback, result))
+        Database.close()
+
+    # Given a callback, passes it to the scheduler (unless the writer has been closed).
+    # Any error raised by the scheduler is ignored, as it means the main loop has stopped.
+    def _schedule(self, callback):
+        with self._condition:
+            scheduler = self._scheduler
+        if scheduler is None:
+            return
+        try:
+            scheduler(callback)
+        except Exception:
+            pass
\ No newline at end of file
@@ -1,5 +1,7 @@
 from copy import deepcopy
-from itertools import product
+from itertools import product, chain
+from enum import Enum
+import struct
 
 # Defines an exception that is raised when an error in the game occurs.
 class GameError(Exception):
@@ -14,6 +16,10 @@ class Game:
     DRAW = 4
     ONGOING = 5
 
+    # Games are stored as bytes made up of a header (the format version, board size, winner, and number of pairs captured by each player) followed by the row and column of each move played.
+    FORMAT_VERSION = 1
+    _HEADER = struct.Struct("!BBBBB")
+
     def __init__(self, boardsize):
         self._board = [[Game.EMPTY for _ in range(boardsize)] for _ in range(boardsize)]
         self._captures = {Game.P1: [], Game.P2: []}
@@ -72,6 +78,12 @@ class Game:
     @staticmethod
     def newState(board, captures, player, row, col):
         board, captures = deepcopy(board), deepcopy(captures)
+        opponent = Game.placePiece(board, captures, player, row, col)
+        return board, captures, opponent
+
+    # Given a game state and a move to play, the placePiece function plays the move by changing the board and captures in place, and returns the player to move next.
+    @staticmethod
+    def placePiece(board, captures, player, row, col):
         board[row][col] = player
         opponent = Game.P2 if player == Game.P1 else Game.P1
         pattern = [opponent, opponent, player]
@@ -84,7 +96,7 @@ class Game:
                 captures[player].append([(row+i*rc[0], col+i*rc[1]) for i in range(1, 3)])
                 for i in range(1, 3):
                     board[row+i*rc[0]][col+i*rc[1]] = Game.EMPTY
-        return board, captures, opponent
+        return opponent
 
     # Given a board and captures, the getWinner function returns the player number who won if there's a winner, or Game.DRAW or Game.ONGOING otherwise.
     @staticmethod
@@ -129,26 +141,78 @@ class Game:
             raise GameError("Position is not empty")
 
     # Given a move, the game goes onto its new state by calling the newState function, and updates the winner.
-    # The move and the state of the captures are pushed onto the moveStack.
+    # The move and the pairs it captured are pushed onto the moveStack.
     def play(self, row, col):
-        self.board, self.captures, self.player = Game.newState(self.board, self.captures, self.player, row, col)
+        self._playMove(row, col)
         self.winner = Game.getWinner(self.board, self.captures)
-        self.moveStack.push(deepcopy(self.captures), row, col)
 
-    # Undoes the last move played.
+    # Given a move, the game goes onto its new state by calling the newState function, without updating the winner.
+    # The move and the pairs it captured are pushed onto the moveStack.
+    def _playMove(self, row, col):
+        player, numberOfCaptures = self.player, len(self.captures[self.player])
+        self.board, self.captures, self.player = Game.newState(self.board, self.captures, self.player, row, col)
+        self.moveStack.push(row, col, self.captures[player][numberOfCaptures:])
+
+    # Given a move from a stored game, the game goes onto its new state by changing the board and captures in place, without copying them as the _playMove function does.
+    # The move and the pairs it captured are pushed onto the moveStack.
+    def _replayMove(self, row, col):
+        player, numberOfCaptures = self.player, len(self.captures[self.player])
+        self.player = Game.placePiece(self.board, self.captures, player, row, col)
+        self.moveStack.push(row, col, self.captures[player][numberOfCaptures:])
+
+    # Returns the game stored as bytes: the header, followed by each move played as two bytes (its row and column).
+    def toBytes(self):
+        header = Game._HEADER.pack(Game.FORMAT_VERSION, len(self.board), self.winner, len(self.captures[Game.P1]), len(self.captures[Game.P2]))
+        return header + bytes(chain.from_iterable(self.moveStack.getMoves()))
+
+    # Given bytes made by the toBytes function, returns the game they store, which is rebuilt by replaying its moves.
+    # The winner is taken from the header rather than being worked out after every move (which also keeps the winner of a game that was quit early).
+    # Raises a GameError if the bytes don't store a valid game: each move must be on the board and on an empty position, and the captures made must match the header.
+    @staticmethod
+    def fromBytes(data):
+        if len(data) < Game._HEADER.size:
+            raise GameError("The game ends part of the way through its header")
+        version, boardsize, winner, p1Captures, p2Captures = Game._HEADER.unpack_from(data)
+        if version != Game.FORMAT_VERSION:
+            raise GameError(f"Unknown game format version {version}")
+        if boardsize == 0:
+            raise GameError("The game has no board")
+        if winner not in (Game.P1, Game.P2, Game.DRAW, Game.ONGOING):
+            raise GameError(f"Unknown winner {winner}")
+        moves = data[Game._HEADER.size:]
+        if len(moves) % 2 != 0:
+            raise GameError("The game ends part of the way through a move")
+        game = Game(boardsize)
+        for i in range(0, len(moves), 2):
+            Game.validateRowCol(moves[i], moves[i+1], game.board)
+            game._replayMove(moves[i], moves[i+1])
+        if (len(game.captures[Game.P1]), len(game.captures[Game.P2])) != (p1Captures, p2Captures):
+            raise GameError("The captures made by the moves don't match the game's header")
+        game.winner = winner
+        return game
+
+    # Given a move that has already been validated and played by the LAN server, the game goes onto its new state using the captured pairs and winner worked out by the server.
+    # The move and the pairs it captured are pushed onto the moveStack as in the play function.
+    def applyMove(self, row, col, capturedPairs, winner):
+        self.board[row][col] = self.player
+        for pair in capturedPairs:
+            for cap in pair:
+                self.board[cap[0]][cap[1]] = Game.EMPTY
+        self.captures[self.player].extend(capturedPairs)
+        self.player = Game.P2 if self.player == Game.P1 else Game.P1
+        self.winner = winner
+        self.moveStack.push(row, col, list(capturedPairs))
+
+    # Undoes the last move played. The pairs the move captured are removed from the player's captures and put back on the board.
     def undo(self):
-        row, col = self.moveStack.pop()[1:]
-        if self.moveStack.isEmpty():
-            captures = {Game.P1: [], Game.P2: []}
-        else:
-            captures = self.moveStack.peek()[0]
+        move = self.moveStack.pop()
         otherPlayer = self.player
         self.player = Game.P1 if self.player == Game.P2 else Game.P2
-        while len(captures[self.player]) != len(self.captures[self.player]):
+        for _ in move.capturedPairs:
             lastPair = self.captures[self.player].pop()
             for cap in lastPair:
                 self.board[cap[0]][cap[1]] = otherPlayer
-        self.board[row][col] = Game.EMPTY
+        self.board[move.row][move.col] = Game.EMPTY
 
     # Given a Pente move, boardsize, and whether the move made any captures, the function will return the Pente notation of the move.
     @staticmethod
@@ -174,19 +238,51 @@ class Game:
         if capturesMade: string += "*"
         return string
 
-# The MoveStack class is implemented as a stack used to store the captures and moves played in the game.
+    # Given a file, writes the moves of the game to it in Pente notation, from the first move to the last, with each pair of player 1 and player 2 moves on its own line.
+    # Each move is written as it is reached, and whether it made any captures is taken from the number of pairs it captured, so the time taken grows linearly with the length of the game.
+    def writePenteNotation(self, f):
+        boardsize = len(self.board)
+        for i, (row, col, numberOfCaptures) in enumerate(self.moveStack.iterMoves()):
+            f.write(Game.getPenteMoveNotation(row, col, boardsize, numberOfCaptures > 0))
+            f.write(" " if i%2 == 0 else "\n")
+
+# The Move class stores a move pushed onto the MoveStack: its row and column, and the list of pairs of pieces it captured (which is empty for most moves).
+# Its attributes are held in slots, as a game has a Move for every move played.
+class Move:
+
+    __slots__ = ("row", "col", "capturedPairs")
+
+    def __init__(self, row, col, capturedPairs):
+        self.row = row
+        self.col = col
+        self.capturedPairs = capturedPairs
+
+# The MoveStack class is implemented as a stack used to store the moves played in the game, along with the pairs each move captured.
 class MoveStack:
 
     def __init__(self):
         self._stack = []
 
+    # Called when a MoveStack is unpickled. Older MoveStacks stored the whole captures dictionary with each move, so these are converted into Moves storing the pairs each move captured.
+    def __setstate__(self, state):
+        stack = state["_stack"]
+        if stack and isinstance(stack[0], tuple):
+            moves = []
+            lastCaptures = {Game.P1: [], Game.P2: []}
+            for captures, row, col in stack:
+                capturedPairs = [pair for player in [Game.P1, Game.P2] for pair in captures[player][len(lastCaptures[player]):]]
+                moves.append(Move(row, col, capturedPairs))
+                lastCaptures = captures
+            stack = moves
+        self._stack = stack
+
     # Returns True if the stack is empty and False otherwise.
     def isEmpty(self):
         return len(self._stack) == 0
 
-    # Given a dictionary of captures and a move, the push function pushes this together onto the top of the stack.
-    def push(self, captures, row, col):
-        self._stack.append((captures, row, col))
+    # Given a move and the list of pairs it captured, the push function pushes this together onto the top of the stack as a Move.
+    def push(self, row, col, capturedPairs):
+        self._stack.append(Move(row, col, capturedPairs))
 
     # Removes the top item in the stack and returns it, or raises a game error if the stack is empty.
     def pop(self):
@@ -200,14 +296,35 @@ class MoveStack:
             raise GameError("There have been no previous moves")
         return self._stack[-1]
 
+    # Given a number of moves, returns a list of up to that many of the last moves played (each as a row and column), from the last move played backwards.
+    def getLastMoves(self, number):
+        return [(move.row, move.col) for move in reversed(self._stack[-number:])]
+
+    # Returns a list of the moves in the stack (each as a row and column), from the first move played to the last.
+    def getMoves(self):
+        return [(move.row, move.col) for move in self._stack]
+
+    # Yields each move in the stack from the first move played to the last, as its row, column, and the number of pairs it captured.
+    def iterMoves(self):
+        for move in self._stack:
+            yield move.row, move.col, len(move.capturedPairs)
+
+# The Player Enum class defines different player types.
+Player = Enum("Player", ["MAIN", "OPP", "GUEST", "COMP"])
+
+# The Mode Enum class defines different playing modes.
+Mode = Enum("Mode", ["PVP", "COMP", "LAN"])
+
 # The GameRecord class defines the datatype which all game information is stored as in the datatbase.
 class GameRecord:
 
-    def __init__(self, id=-1, name=-1, whenSaved=-1, game=-1, mode=-1, compDifficulty=-1):
+    def __init__(self, id=-1, name=-1, whenSaved=-1, game=-1, mode=-1, compDifficulty=-1, winner=-1, players=-1):
         self.id = id
         self.name = name
         self.whenSaved = whenSaved
         self.game = game
         self.mode = mode
         self.compDifficulty = compDifficulty
+        self.winner = winner
+        self.players = players
 
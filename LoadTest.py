@@ -0,0 +1,254 @@
+from Server import Server
+from Router import Router
+from Client import Client
+from Game import Game
+from multiprocessing import Process
+import threading
+import argparse
+import random
+import socket
+import signal
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The LoadTest program starts a Server (or, with a number of workers, a sharded Router and its workers) on localhost in its own process, and runs a number of simulated LAN clients against it, each in its own thread.
+# Each simulated client connects, asks for an opponent, plays a random (or scripted) game through makeMove/getMove, and then disconnects.
+# Once every client has finished, the connection rate, match-up latency, move relay latency percentiles, and the server's CPU and memory use are reported.
+
+# The LoadStats class collects the measurements made by the simulated clients. All methods are run under a lock, as they are called from every client thread.
+class LoadStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connectTimes = []
+        self._matchLatencies = []
+        self._relayLatencies = []
+        self._sentMoves = {}
+        self._gamesFinished = 0
+        self._errors = []
+
+    @property
+    def connectTimes(self):
+        return self._connectTimes
+
+    @property
+    def matchLatencies(self):
+        return self._matchLatencies
+
+    @property
+    def relayLatencies(self):
+        return self._relayLatencies
+
+    @property
+    def gamesFinished(self):
+        return self._gamesFinished
+
+    @property
+    def errors(self):
+        return self._errors
+
+    # Given the time a client started and finished connecting to the server, records the connection.
+    def addConnection(self, start, end):
+        with self._lock:
+            self._connectTimes.append((start, end))
+
+    # Given the time taken for a client to be given an opponent, records the match-up latency.
+    def addMatchLatency(self, latency):
+        with self._lock:
+            self._matchLatencies.append(latency)
+
+    # Given a game id and a move, records the time the move was sent, so the relay latency can be worked out when the opponent receives it.
+    def moveSent(self, gameId, row, col):
+        with self._lock:
+            self._sentMoves[(gameId, row, col)] = time.perf_counter()
+
+    # Given a game id and a move which has been received by the opponent, records the time taken to relay the move.
+    def moveReceived(self, gameId, row, col):
+        now = time.perf_counter()
+        with self._lock:
+            sent = self._sentMoves.pop((gameId, row, col), None)
+            if sent is not None:
+                self._relayLatencies.append(now - sent)
+
+    # Records that a client has finished a game.
+    def gameFinished(self):
+        with self._lock:
+            self._gamesFinished += 1
+
+    # Given the username of a client and an exception, records that the client failed.
+    def addError(self, username, e):
+        with self._lock:
+            self._errors.append(f"{username}: {e!r}")
+
+# Given a list of numbers and a percentage, returns the value at that percentile of the numbers (or None if there are no numbers).
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values)-1, max(0, round(p/100 * len(values)) - 1))
+    return values[index]
+
+# Given a game and a random number generator, returns a random empty intersection on the board (the first move is always the centre of the board).
+def pickMove(game, rng):
+    boardsize = len(game.board)
+    if game.moveStack.isEmpty():
+        return boardsize//2, boardsize//2
+    while True:
+        row, col = rng.randrange(boardsize), rng.randrange(boardsize)
+        if game.board[row][col] == Game.EMPTY:
+            return row, col
+
+# Given the path of a script file, returns the list of moves in it. Each line of the file is a move written as the row and column separated by a space.
+def loadScript(path):
+    moves = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row, col = line.split()
+                moves.append((int(row), int(col)))
+    return moves
+
+# Run by each simulated client thread: connects to the server, gets an opponent, plays a game, and disconnects.
+# Moves are taken from the script if one is given, and are random otherwise. A player quits the game once maxMoves moves have been played or the script runs out.
+def simulateClient(username, host, port, stats, maxMoves, script, seed):
+    rng = random.Random(seed)
+    client = Client(username, host, port)
+    try:
+        start = time.perf_counter()
+        client.makeConnection()
+        stats.addConnection(start, time.perf_counter())
+
+        start = time.perf_counter()
+        client.getOpponent()
+        stats.addMatchLatency(time.perf_counter() - start)
+
+        game = Game(19)
+        numberOfMoves = 0
+        while game.winner == Game.ONGOING:
+            if game.player == client.playerNo:
+                if numberOfMoves >= maxMoves or (script is not None and numberOfMoves >= len(script)):
+                    client.makeMove((-1, -1))
+                    break
+                row, col = script[numberOfMoves] if script is not None else pickMove(game, rng)
+                stats.moveSent(client.gameId, row, col)
+                client.makeMove((row, col))
+                game.play(row, col)
+            else:
+                delta = client.getMove()
+                if delta.isForfeit():
+                    break
+                stats.moveReceived(client.gameId, delta.row, delta.col)
+                game.applyMove(delta.row, delta.col, delta.capturedPairs, delta.winner)
+            numberOfMoves += 1
+        client.closeConnection()
+        stats.gameFinished()
+    except Exception as e:
+        stats.addError(username, e)
+
+# Run by the server process: runs a Server on the given host and port, with its stats endpoint on the next port.
+# If a number of workers is given, a Router is run instead, and the server process exits cleanly when terminated so that the worker processes are stopped too.
+def runServer(host, port, workers=None):
+    if workers:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        Router(workers, host=host, port=port, statsPort=port+1, logInterval=None).run()
+    else:
+        Server(host=host, port=port, statsPort=port+1, logInterval=None).run()
+
+# Given a host and port, waits until the server is accepting connections.
+def waitForServer(host, port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The server did not start")
+
+# Given the process id of the server, returns the CPU time (in seconds) used by it and its child processes (the workers of a sharded server) and their total peak resident memory (in KB) by reading /proc, or None if it can't be read.
+def readProcUsage(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids = [pid] + [int(child) for child in f.read().split()]
+        cpuTime, memory = 0, 0
+        for p in pids:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpuTime += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            with open(f"/proc/{p}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+            memory += int(status["VmHWM"].split()[0])
+        return cpuTime, memory
+    except (OSError, KeyError, ValueError, IndexError):
+        return None
+
+# Returns the CPU time (in seconds) and peak memory (in KB) used by the finished child processes of the load test, or None if the resource module isn't available.
+def readChildUsage():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+# Given the measurements, the time taken, and the server's resource usage, prints a report of the load test.
+def printReport(stats, numberOfClients, duration, serverUsage):
+    print(f"\nClients: {numberOfClients}, games finished: {stats.gamesFinished}/{numberOfClients}, errors: {len(stats.errors)}")
+    for error in stats.errors[:10]:
+        print(f"  {error}")
+    if stats.connectTimes:
+        connectPeriod = max(end for _, end in stats.connectTimes) - min(start for start, _ in stats.connectTimes)
+        print(f"Connection rate: {len(stats.connectTimes)/max(connectPeriod, 1e-9):.1f} connections/s")
+    for name, values in [("Match-up latency", stats.matchLatencies), ("Move relay latency", stats.relayLatencies)]:
+        if values:
+            p50, p90, p99 = (percentile(values, p)*1000 for p in [50, 90, 99])
+            print(f"{name} ({len(values)} samples): p50 {p50:.2f}ms, p90 {p90:.2f}ms, p99 {p99:.2f}ms, max {max(values)*1000:.2f}ms")
+    print(f"Total time: {duration:.2f}s")
+    if serverUsage is None:
+        print("Server CPU and memory: unavailable on this platform")
+    else:
+        cpuTime, memory = serverUsage
+        print(f"Server CPU: {cpuTime:.2f}s ({100*cpuTime/duration:.1f}% of one core), peak memory: {memory/1024:.1f}MB")
+
+# Starts the server, runs the simulated clients, and prints the report.
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Pente LAN server with simulated clients on localhost.")
+    parser.add_argument("-n", "--clients", type=int, default=100, help="number of simulated clients (rounded up to an even number)")
+    parser.add_argument("-m", "--max-moves", type=int, default=60, help="moves played in a game before a player quits")
+    parser.add_argument("-s", "--script", help="file of moves (row and column on each line) to play instead of random moves")
+    parser.add_argument("-p", "--port", type=int, default=8090, help="port to run the server on")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="run a sharded server with this many worker processes (on the ports after the stats port)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random moves")
+    args = parser.parse_args()
+
+    host = "127.0.0.1"
+    numberOfClients = args.clients + args.clients%2
+    script = loadScript(args.script) if args.script else None
+    seedRng = random.Random(args.seed)
+
+    server = Process(target=runServer, args=(host, args.port, args.workers))
+    server.start()
+    waitForServer(host, args.port)
+
+    stats = LoadStats()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=simulateClient, args=(f"loadtest{i}", host, args.port, stats, args.max_moves, script, seedRng.random())) for i in range(numberOfClients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    serverUsage = readProcUsage(server.pid)
+    server.terminate()
+    server.join()
+    if serverUsage is None:
+        serverUsage = readChildUsage()
+    printReport(stats, numberOfClients, duration, serverUsage)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,26 +1,49 @@
 from Ui import Gui, Terminal
 from sys import argv
 import Database
+import Archive
 
 # If no recognised command is input to the terminal, the usage function displays a usage message.
 def usage():
     print(f"""
-Usage: {argv[0]} [g | t]
+Usage: {argv[0]} [g | t | export <file> [username] | import <file> | check]
 g: play with GUI
-t: play with Terminal""")
+t: play with Terminal
+export: write every saved game (or every saved game of a player) to an archive file, which is compressed if the file name ends in .gz
+import: add every game in an archive file to the database
+check: check that every query used to look up games and players uses an index""")
     quit()
 
-# If the program is run, depending on the command, the program will run one of the graphical UI or the terminal UI.
-# A new database is also created if not database is detected to exist, which is done by calling the database's exists function.
+# If the program is run, depending on the command, the program will run one of the graphical UI or the terminal UI, export or import an archive of saved games, or check the query plans of the database.
+# A new database is also created if not database is detected to exist, which is done by calling the database's exists function, and the schema of the database is brought up to date.
+# Once the user has finished, the connection to the database is closed.
 if __name__ == "__main__":
-    if len(argv) != 2:
-        usage()
-    elif argv[1] == "g":
+    ui = None
+    if len(argv) == 2 and argv[1] == "g":
         ui = Gui()
-    elif argv[1] == "t":
+    elif len(argv) == 2 and argv[1] == "t":
         ui = Terminal()
-    else:
+    elif not ((len(argv) in [3, 4] and argv[1] == "export") or (len(argv) == 3 and argv[1] == "import") or (len(argv) == 2 and argv[1] == "check")):
         usage()
     if not Database.exists():
         Database.createDatabase()
-    ui.run()
\ No newline at end of file
+    Database.migrate()
+    if ui is not None:
+        ui.run()
+    elif argv[1] == "check":
+        scans = Database.checkQueryPlans()
+        for statement, detail in scans:
+            print(f"{detail}: {statement}")
+        if not scans:
+            print("Every query uses an index")
+    else:
+        try:
+            if argv[1] == "export":
+                numberOfGames = Archive.exportGames(argv[2], argv[3] if len(argv) == 4 else None, argv[2].endswith(".gz"))
+                print(f"Exported {numberOfGames} games to {argv[2]}")
+            else:
+                numberOfGames = Archive.importGames(argv[2])
+                print(f"Imported {numberOfGames} games from {argv[2]}")
+        except (Archive.ArchiveError, OSError) as e:
+            print(f"Unable to {argv[1]} games: {e}")
+    Database.close()
\ No newline at end of file
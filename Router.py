@@ -0,0 +1,180 @@
+from Server import Server
+from ServerClientDatatypes import Msg, Cmd
+from multiprocessing import Process, Pipe
+from itertools import count
+from sys import argv
+import threading
+import queue
+import os
+
+# The Router and Worker classes run the LAN server in sharded mode, so that games are spread across several processes (and so several cores) instead of all being run by one Server process.
+# The router is the server that clients connect to. It matches users up, assigns each new game to the worker running the fewest games, and redirects the players to that worker, where they join the game by resuming it.
+# Requests to spectate or resume a game are redirected to the worker running it by game id, and the list of ongoing games is kept by the router, so the workers never need to talk to each other.
+# The router and each worker coordinate over a multiprocessing pipe.
+
+# The Worker class is a Server which runs one shard of the games of a sharded server.
+# Games are created when the router sends their details down the pipe, and the router is told when each game ends.
+class Worker(Server):
+
+    def __init__(self, pipe, host=None, port=8082, resumeTimeout=60, idleTimeout=30):
+        super().__init__(resumeTimeout=resumeTimeout, idleTimeout=idleTimeout, host=host, port=port, statsPort=None, logInterval=None)
+        self._pipe = pipe
+        self._pipeLock = threading.Lock()
+
+    # Runs the worker, along with a thread which reads the messages sent by the router.
+    def run(self):
+        threading.Thread(target=self._readPipe, daemon=True).start()
+        super().run()
+
+    # Run by the pipe reading thread: creates each game the router assigns to the worker, and replies with the tokens of the game's seats.
+    # The seats start without a connection, so a player who never joins the game is removed from it once the resume timeout runs out. The worker process exits if the router stops.
+    def _readPipe(self):
+        while True:
+            try:
+                gameId, u1, p1, u2, p2 = self._pipe.recv()
+            except EOFError:
+                os._exit(0)
+            session = self.sessions.create(u1, None, p1, u2, None, p2, gameId)
+            with session.lock:
+                for seat in session.seats.values():
+                    self._startResumeTimer(session, seat)
+            self._sendToRouter(("created", gameId, {seat.username: seat.token for seat in session.seats.values()}))
+
+    # Given a message, sends it to the router. Messages are sent under a lock, as they are sent from the client handling threads as well as the pipe reading thread.
+    def _sendToRouter(self, message):
+        with self._pipeLock:
+            self._pipe.send(message)
+
+    # Tells the router that the game of a session has ended, so that it is no longer listed.
+    def _gameEnded(self, session):
+        self._sendToRouter(("ended", session.gameId))
+
+# The WorkerHandle class holds what the router knows about one of its workers: the router's end of the pipe, the address clients are redirected to, and the number of ongoing games the worker is running.
+class WorkerHandle:
+
+    def __init__(self, pipe, address):
+        self.pipe = pipe
+        self.address = address
+        self.games = 0
+        self._lock = threading.Lock()
+
+    # Given a message, sends it to the worker.
+    def send(self, message):
+        with self._lock:
+            self.pipe.send(message)
+
+# Run by each worker process: runs a Worker on the given host and port.
+def runWorker(pipe, host, port, resumeTimeout, idleTimeout):
+    Worker(pipe, host, port, resumeTimeout, idleTimeout).run()
+
+# The Router class is the Server that clients connect to when the LAN server is run in sharded mode.
+# It starts the worker processes (on the ports after the stats port by default), and keeps a directory of the ongoing games: the worker each is running on, and its players.
+class Router(Server):
+
+    def __init__(self, numberOfWorkers=2, rankBucketSize=None, resumeTimeout=60, idleTimeout=30, host=None, port=8080, workerPorts=None, statsPort=8081, logInterval=60):
+        super().__init__(rankBucketSize, resumeTimeout, idleTimeout, host, port, statsPort, logInterval)
+        self._CREATE_TIMEOUT = 10
+        self._workerPorts = workerPorts if workerPorts is not None else [port+2+i for i in range(numberOfWorkers)]
+        self._workers = []
+        self._games = {}
+        self._pendingGames = {}
+        self._gameIds = count(1)
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def games(self):
+        return self._games
+
+    # Starts a worker process for each worker port, along with a thread reading the messages each worker sends, and then runs the router.
+    def run(self):
+        for workerPort in self._workerPorts:
+            routerEnd, workerEnd = Pipe()
+            Process(target=runWorker, args=(workerEnd, self._host, workerPort, self._RESUME_TIMEOUT, self._IDLE_TIMEOUT), daemon=True).start()
+            worker = WorkerHandle(routerEnd, (self._host, workerPort))
+            self.workers.append(worker)
+            threading.Thread(target=self._readPipe, args=(worker,), daemon=True).start()
+        super().run()
+
+    # Run by the pipe reading thread of a worker: passes on the seat tokens of each game the worker has created, and removes each game that has ended from the directory.
+    def _readPipe(self, worker):
+        while True:
+            try:
+                message = worker.pipe.recv()
+            except EOFError:
+                print(f"The worker on port {worker.address[1]} has stopped")
+                return
+            if message[0] == "created":
+                _, gameId, tokens = message
+                with self._lock:
+                    created = self._pendingGames.pop(gameId, None)
+                if created is not None:
+                    created.put(tokens)
+            elif message[0] == "ended":
+                with self._lock:
+                    if self.games.pop(message[1], None) is not None:
+                        worker.games -= 1
+
+    # Given the username, connection, and player number of two matched users, assigns their game to the worker running the fewest games.
+    # Once the worker has created the game, each client is sent their opponent, the game id, the token of their seat, and the address of the worker to join the game on.
+    def _createGame(self, u1, conn1, p1, u2, conn2, p2):
+        with self._lock:
+            gameId = next(self._gameIds)
+            worker = min(self.workers, key=lambda worker: worker.games)
+            worker.games += 1
+            self.games[gameId] = (worker, {p1: u1, p2: u2})
+            created = self._pendingGames[gameId] = queue.Queue(1)
+        worker.send((gameId, u1, p1, u2, p2))
+        try:
+            tokens = created.get(timeout=self._CREATE_TIMEOUT)
+        except queue.Empty:
+            print(f"The worker on port {worker.address[1]} didn't create game {gameId}")
+            with self._lock:
+                self._pendingGames.pop(gameId, None)
+                if self.games.pop(gameId, None) is not None:
+                    worker.games -= 1
+            conn1.shutdown()
+            conn2.shutdown()
+            return
+        conn1.send(Msg(None, (u2, p1), args=(gameId, tokens[u1], worker.address)))
+        conn2.send(Msg(None, (u1, p2), args=(gameId, tokens[u2], worker.address)))
+
+    # Returns a list of the games being played on the workers, each given as its game id and a dictionary of the player usernames.
+    def _getGames(self):
+        with self._lock:
+            return [(gameId, players) for gameId, (_, players) in self.games.items()]
+
+    # Given a game id, returns the worker running the game with that id, or None if there is no such game.
+    def _getWorker(self, gameId):
+        with self._lock:
+            game = self.games.get(gameId)
+        return game[0] if game is not None else None
+
+    # Given the connection of a client and a game id, redirects the client to the worker running the game (or tells the client there is no such game).
+    # Returns None, as the client spectates the game on the worker rather than the router.
+    def _spectate(self, conn, gameId):
+        worker = self._getWorker(gameId)
+        if worker is None:
+            conn.send(Msg(None, None, args=gameId))
+        else:
+            conn.send(Msg(None, Cmd.REDIRECT, args=worker.address))
+        return None
+
+    # Given a player resuming a game through the router, redirects their client to the worker running the game (or tells the client there is no such game).
+    # Returns False, as the game is resumed on the worker rather than the router.
+    def _resumeUser(self, username, conn, gameId, token, lastSeq):
+        worker = self._getWorker(gameId)
+        if worker is None:
+            conn.send(Msg(None, None, args=gameId))
+        else:
+            conn.send(Msg(None, Cmd.REDIRECT, args=worker.address))
+        return False
+
+# The router can be given the number of workers as a command line argument (the number of CPU cores by default), followed by a rank bucket size.
+if __name__ == "__main__":
+    numberOfWorkers = int(argv[1]) if len(argv) > 1 else os.cpu_count()
+    rankBucketSize = int(argv[2]) if len(argv) > 2 else None
+    router = Router(numberOfWorkers, rankBucketSize)
+    router.run()
\ No newline at end of file
@@ -1,19 +1,388 @@
 import socket
 import threading
-import pickle
+import queue
 import time
-from Game import Game
-from ServerClientDatatypes import Msg, Cmd
+from itertools import count
+from Game import Game, GameError
+from ServerClientDatatypes import Msg, Cmd, MoveDelta, encodeMsg, recvMsg
+from ServerMetrics import ServerMetrics
+from collections import OrderedDict
+from sys import argv
 import random
+import secrets
+import hmac
+
+# The Matchmaker class holds the users waiting for an opponent (along with their connections) in first-in-first-out queues, and pairs them up in constant time.
+# If a rank bucket size is given, waiting users are grouped by their score so that players are matched with others of a similar rank.
+# All methods are run under a lock, as they are called from the server's client handling threads.
+class Matchmaker:
+
+    def __init__(self, rankBucketSize=None):
+        self._rankBucketSize = rankBucketSize
+        self._queues = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rankBucketSize(self):
+        return self._rankBucketSize
+
+    # Returns the number of users currently waiting for an opponent.
+    def __len__(self):
+        with self._lock:
+            return len(self._waiting)
+
+    # Given a score, returns the bucket that users with that score wait in.
+    def _getBucket(self, score):
+        if not self.rankBucketSize or score is None:
+            return 0
+        return score // self.rankBucketSize
+
+    # Given a username, their connection, and their score, returns the username and connection of a waiting opponent in the same (or an adjacent) rank bucket if there is one.
+    # Otherwise the user is added to the back of the queue for their bucket, and None is returned.
+    def join(self, username, conn, score=None):
+        bucket = self._getBucket(score)
+        with self._lock:
+            if username in self._waiting:
+                return None
+            for b in [bucket, bucket-1, bucket+1]:
+                queue = self._queues.get(b)
+                if queue:
+                    opponent = queue.popitem(last=False)
+                    del self._waiting[opponent[0]]
+                    return opponent
+            self._queues.setdefault(bucket, OrderedDict())[username] = conn
+            self._waiting[username] = bucket
+            return None
+
+    # Removes a user from the waiting queue (if they are waiting), e.g. when they disconnect.
+    # If a connection is given, the user is only removed if they are waiting on that connection.
+    def leave(self, username, conn=None):
+        with self._lock:
+            bucket = self._waiting.get(username)
+            if bucket is not None and (conn is None or self._queues[bucket][username] is conn):
+                del self._waiting[username]
+                del self._queues[bucket][username]
+
+# The Connection class sends messages to a single client.
+# Encoded messages are put on a bounded outbound queue and sent in order by the connection's own thread, so the threads handling other clients never wait on a slow client.
+# If the queue fills up, the client has stopped reading from its connection, so the connection is shut down.
+class Connection:
+
+    def __init__(self, c, metrics, maxQueued=64):
+        self._c = c
+        self._metrics = metrics
+        self._outbound = queue.Queue(maxQueued)
+        self._closed = False
+        self._lastActivity = time.monotonic()
+        self._thread = threading.Thread(target=self._send, daemon=True)
+        self._thread.start()
+
+    @property
+    def c(self):
+        return self._c
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def lastActivity(self):
+        return self._lastActivity
+
+    # Records that a message has been received from the client.
+    def touch(self):
+        self._lastActivity = time.monotonic()
+
+    # Given a message, encodes it and adds it to the outbound queue.
+    # Returns False if the connection has been shut down.
+    def send(self, msg):
+        return self.sendEncoded(encodeMsg(msg))
+
+    # Given an encoded message (and the time the move in it was received, if the relay is to be timed), adds it to the outbound queue.
+    # Returns False if the connection has been shut down (including if the queue was full).
+    def sendEncoded(self, data, receivedAt=None):
+        return self._put((data, receivedAt))
+
+    # Given a list of encoded messages, adds them to the outbound queue as a single item, so that a long backlog of moves doesn't fill the queue.
+    def sendBacklog(self, backlog):
+        return self._put((backlog, None))
+
+    # Given an item, adds it to the outbound queue, shutting down the connection if the queue is full.
+    def _put(self, item):
+        if self.closed:
+            return False
+        try:
+            self._outbound.put_nowait(item)
+        except queue.Full:
+            self.shutdown()
+            return False
+        return True
+
+    # Shuts down the connection straight away, which makes the threads reading from and sending to it stop.
+    def shutdown(self):
+        self._closed = True
+        try:
+            self.c.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # Shuts down the connection once everything already on the outbound queue has been sent.
+    def close(self):
+        if not self._put(None):
+            self.shutdown()
+
+    # Run by the connection's thread: sends each item on the outbound queue, timing the relay of moves, until the connection is closed.
+    def _send(self):
+        try:
+            while not self.closed:
+                try:
+                    item = self._outbound.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                data, receivedAt = item
+                for d in (data if isinstance(data, list) else [data]):
+                    self.c.sendall(d)
+                if receivedAt is not None:
+                    self._metrics.recordRelay(time.perf_counter() - receivedAt)
+        except OSError:
+            pass
+        self.shutdown()
+        self.c.close()
+
+# The Seat class holds everything the server knows about one of the two players in a game session.
+# The seat's token is given to the player's client so that it can resume the game if its connection drops (in which case conn is None until it does).
+class Seat:
+
+    def __init__(self, username, conn, playerNo):
+        self.username = username
+        self.conn = conn
+        self.playerNo = playerNo
+        self.token = secrets.token_hex(16)
+        self.movesPlayed = 0
+        self.resumeTimer = None
+        self.left = False
+
+    # Given the connection of a resumed client and the encoded messages the player missed, moves the seat onto the new connection and sends the missed messages.
+    # Returns the old connection.
+    def reconnect(self, conn, missed):
+        oldConn = self.conn
+        self.conn = conn
+        conn.sendBacklog(missed)
+        return oldConn
+
+# The Session class contains the information about a single game being played on the server: its game id, the two seats, the move sequence number, and the game itself.
+# The server's game is the authoritative state of the game, so every move is validated and played on it before being sent on to the clients.
+class Session:
+
+    def __init__(self, gameId, seats, boardsize=19):
+        self._gameId = gameId
+        self._seats = seats
+        self._seq = 0
+        self._game = Game(boardsize)
+        self._moveLog = []
+        self._spectators = []
+        self._lock = threading.RLock()
+
+    @property
+    def gameId(self):
+        return self._gameId
+
+    @property
+    def seats(self):
+        return self._seats
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def game(self):
+        return self._game
+
+    @property
+    def moveLog(self):
+        return self._moveLog
+
+    @property
+    def spectators(self):
+        return self._spectators
+
+    @property
+    def lock(self):
+        return self._lock
+
+    # Returns a dictionary of the usernames of player 1 and player 2.
+    def getPlayers(self):
+        return {playerNo: seat.username for playerNo, seat in self.seats.items()}
+
+    # Given an encoded message, adds it to the move log and sends it to every spectator, removing any spectators whose connections have been shut down.
+    # Once the game has ended, the spectators' connections are closed.
+    def publish(self, data):
+        with self.lock:
+            self.moveLog.append(data)
+            self._spectators = [conn for conn in self.spectators if conn.sendEncoded(data)]
+            if self.game.winner != Game.ONGOING:
+                for conn in self.spectators:
+                    conn.close()
+                self._spectators = []
+
+    # Given the connection of a spectator, sends the spectator the players of the game, followed by the move log, and adds them to the spectators sent every move played after.
+    def addSpectator(self, conn):
+        with self.lock:
+            conn.sendBacklog([encodeMsg(Msg(None, self.getPlayers(), args=self.gameId))] + self.moveLog)
+            if self.game.winner == Game.ONGOING:
+                self.spectators.append(conn)
+            else:
+                conn.close()
+
+    # Given the connection of a spectator, stops them spectating the game.
+    def removeSpectator(self, conn):
+        with self.lock:
+            if conn in self.spectators:
+                self.spectators.remove(conn)
+
+    # Given a username, returns the seat of that player.
+    def getSeat(self, username):
+        for seat in self.seats.values():
+            if seat.username == username:
+                return seat
+
+    # Given a username, returns the seat of that player's opponent.
+    def getOpponentSeat(self, username):
+        for seat in self.seats.values():
+            if seat.username != username:
+                return seat
+
+    # Returns the sequence number of the next move played in the game.
+    def nextSeq(self):
+        with self.lock:
+            self._seq += 1
+            return self._seq
+
+    # Given the username of the player making the move and the move, validates the move and plays it on the game.
+    # Returns a MoveDelta of the changes made by the move, or raises a GameError if the move isn't valid.
+    def play(self, username, row, col):
+        with self.lock:
+            player = self.getSeat(username).playerNo
+            if self.game.winner != Game.ONGOING:
+                raise GameError("The game has ended")
+            elif player != self.game.player:
+                raise GameError("It is not this player's turn")
+            Game.validateRowCol(row, col, self.game.board)
+            numberOfCaptures = len(self.game.captures[player])
+            self.game.play(row, col)
+            self.getSeat(username).movesPlayed += 1
+            capturedPairs = self.game.captures[player][numberOfCaptures:]
+            return MoveDelta(self.nextSeq(), row, col, player, capturedPairs, self.game.winner)
+
+    # Given the username of a player, ends the game with their opponent as the winner and returns a MoveDelta for the forfeit.
+    # Returns None if the game has already ended.
+    def forfeit(self, username):
+        with self.lock:
+            if self.game.winner != Game.ONGOING:
+                return None
+            player = self.getSeat(username).playerNo
+            self.game.winner = self.getOpponentSeat(username).playerNo
+            return MoveDelta(self.nextSeq(), -1, -1, player, [], self.game.winner)
+
+# The SessionRegistry class keeps track of every game session being played on the server, both by game id and by the usernames of the players.
+# All methods are run under a lock, as they are called from the server's client handling threads.
+class SessionRegistry:
+
+    def __init__(self):
+        self._sessions = {}
+        self._userSessions = {}
+        self._gameIds = count(1)
+        self._lock = threading.Lock()
+
+    # Returns the number of games currently being played.
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    # Given the username, connection, and player number of both players, creates a new session for their game and returns it.
+    # The game id can be given (e.g. by the router of a sharded server), and is taken from the registry's own count otherwise.
+    # A player still seated in an earlier session leaves it, so that the earlier session isn't kept once both its players have moved on.
+    def create(self, u1, conn1, p1, u2, conn2, p2, gameId=None):
+        with self._lock:
+            self._leave(u1)
+            self._leave(u2)
+            seats = {p1: Seat(u1, conn1, p1), p2: Seat(u2, conn2, p2)}
+            session = Session(gameId if gameId is not None else next(self._gameIds), seats)
+            self._sessions[session.gameId] = session
+            self._userSessions[u1] = session
+            self._userSessions[u2] = session
+            return session
+
+    # Given a game id, returns the session with that game id, or None if there isn't one.
+    def get(self, gameId):
+        with self._lock:
+            return self._sessions.get(gameId)
+
+    # Returns a list of the sessions of every game that hasn't yet ended.
+    def getOngoing(self):
+        with self._lock:
+            return [session for session in self._sessions.values() if session.game.winner == Game.ONGOING]
+
+    # Given a username, returns the session the player is playing in, or None if they are not playing.
+    def getByUsername(self, username):
+        with self._lock:
+            return self._userSessions.get(username)
+
+    # Given a username, removes the player from their session and returns the session (or None if they weren't playing).
+    # If a connection is given, the player is only removed if their seat is on that connection. Once both players have left, the session is removed from the registry.
+    def leave(self, username, conn=None):
+        with self._lock:
+            session = self._userSessions.get(username)
+            if session is None or (conn is not None and session.getSeat(username).conn is not conn):
+                return None
+            return self._leave(username)
+
+    # Given a session whose game has ended, removes it from the registry, so that finished games aren't kept (or counted) once they are over.
+    # Its seats are left as they are, so the players' connections still get any messages already being sent to them, but the resume timeouts of any disconnected seats are cancelled.
+    def end(self, session):
+        with self._lock:
+            self._sessions.pop(session.gameId, None)
+            for seat in session.seats.values():
+                if seat.resumeTimer is not None:
+                    seat.resumeTimer.cancel()
+                    seat.resumeTimer = None
+                if self._userSessions.get(seat.username) is session:
+                    del self._userSessions[seat.username]
+
+    # Given a username, removes the player from their session as the leave method does. Must be called while holding the registry's lock.
+    def _leave(self, username):
+        session = self._userSessions.pop(username, None)
+        if session is None:
+            return None
+        session.getSeat(username).left = True
+        if all(seat.left for seat in session.seats.values()):
+            self._sessions.pop(session.gameId, None)
+        return session
 
 # The Server class contains all properties and methods required by the server.
 # The server controls the interactions between clients.
+# Clients send heartbeats while they are connected, and a reaper shuts down the connection of any client which has been silent for longer than the idle timeout.
 # An instance of the Server class is created on running the Server.py program, and ther server is run.
 # On running the server, the server will not stop running until the program is quitted.
 class Server:
 
-    def __init__(self):
+    def __init__(self, rankBucketSize=None, resumeTimeout=60, idleTimeout=30, host=None, port=8080, statsPort=8081, logInterval=60):
+        self._RESUME_TIMEOUT = resumeTimeout
+        self._IDLE_TIMEOUT = idleTimeout
+        self._host = host if host is not None else socket.gethostname()
+        self._port = port
+        self._statsPort = statsPort
+        self._logInterval = logInterval
+        self._metrics = ServerMetrics(self)
         self._onlineUsers = {}
+        self._connections = set()
+        self._matchmaker = Matchmaker(rankBucketSize)
+        self._sessions = SessionRegistry()
+        self._lock = threading.Lock()
 
     @property
     def onlineUsers(self):
@@ -23,62 +392,289 @@ class Server:
     def onlineUsers(self, onlineUsers):
         self._onlineUsers = onlineUsers
 
-    # Runs the server through the 8080 port.
+    @property
+    def connections(self):
+        return self._connections
+
+    @property
+    def matchmaker(self):
+        return self._matchmaker
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    # Runs the server through the given port (8080 by default).
+    # The stats endpoint is run on localhost through the stats port, and a line of stats is printed every log interval (either can be turned off by setting it to None).
+    # Unless the idle timeout is None, the reaper thread is started.
     # Continuously listens out for client messages, and responds using the handleClient method.
     def run(self):
         print("Server is running...")
-        host = socket.gethostname()
-        port = 8080
-
+        if self._statsPort is not None:
+            self.metrics.startEndpoint("127.0.0.1", self._statsPort)
+        if self._logInterval is not None:
+            self.metrics.startLogging(self._logInterval)
+        if self._IDLE_TIMEOUT is not None:
+            threading.Thread(target=self._reap, daemon=True).start()
         s = socket.socket()
-        s.bind((host, port))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self._host, self._port))
+        s.listen(128)
 
         while 1:
-            s.listen(1)
             c, addr = s.accept()
             x = threading.Thread(target=self._handleClient, args=(c,))
             x.start()
 
-    # Matches two online users waiting to play together, and sends messages notifying each client of their opponent.
-    def _getOpponent(self):
-        notPlaying = []
-        for username, status in self.onlineUsers.items():
-            if status[1] == False: notPlaying.append(username)
-        while len(notPlaying) > 1:
-            u1 = notPlaying.pop()
-            u2 = notPlaying.pop()
-            self.onlineUsers[u1][1], self.onlineUsers[u2][1] = True, True
+    # Run by the reaper thread: every half of the idle timeout, shuts down the connection of any client which hasn't sent a message (not even a heartbeat) within the idle timeout.
+    # Shutting down the connection makes the thread handling it remove the user, which frees their place in the matchmaking queue (or starts the resume timeout of their seat).
+    def _reap(self):
+        while True:
+            time.sleep(self._IDLE_TIMEOUT/2)
+            now = time.monotonic()
+            with self._lock:
+                idle = [conn for conn in self.connections if now - conn.lastActivity > self._IDLE_TIMEOUT]
+            for conn in idle:
+                conn.shutdown()
+                self.metrics.countReaped()
+
+    # Given a user looking for a game, their connection, and their score, adds them to the matchmaking queue.
+    # If an opponent is found, the two users are randomly given a player number each, and a game is created for them on the connections they were queued with.
+    def _getOpponent(self, username, conn, score=None):
+        match = self.matchmaker.join(username, conn, score)
+        if match is not None:
+            u1, conn1 = username, conn
+            u2, conn2 = match
             playerIndex = random.randint(0, 1)
             p1, p2 = [Game.P1, Game.P2][playerIndex], [Game.P1, Game.P2][not playerIndex]
-            self.onlineUsers[u1][0].send(pickle.dumps(Msg(None, (u2, p1))))
-            self.onlineUsers[u2][0].send(pickle.dumps(Msg(None, (u1, p2))))
+            self._createGame(u1, conn1, p1, u2, conn2, p2)
+
+    # Given the username, connection, and player number of two matched users, creates a new game session for them.
+    # Messages are sent notifying each client of their opponent, the game id, and the token of their seat.
+    # A user whose connection was dropped while the game was being created is disconnected from it here, as the thread handling their connection may have finished before the game existed.
+    def _createGame(self, u1, conn1, p1, u2, conn2, p2):
+        session = self.sessions.create(u1, conn1, p1, u2, conn2, p2)
+        conn1.send(Msg(None, (u2, p1), args=(session.gameId, session.getSeat(u1).token)))
+        conn2.send(Msg(None, (u1, p2), args=(session.gameId, session.getSeat(u2).token)))
+        for username, conn in [(u1, conn1), (u2, conn2)]:
+            with self._lock:
+                dropped = conn not in self.connections
+            if dropped:
+                self._disconnectUser(username, conn)
+
+    # Returns a list of the games being played on the server, each given as its game id and a dictionary of the player usernames.
+    def _getGames(self):
+        return [(session.gameId, session.getPlayers()) for session in self.sessions.getOngoing()]
+
+    # Given the connection of a client and a game id, starts the client spectating the game with that id.
+    # Returns the session of the game, or None if there is no such game (which the client is told).
+    def _spectate(self, conn, gameId):
+        session = self.sessions.get(gameId)
+        if session is None:
+            conn.send(Msg(None, None, args=gameId))
+        else:
+            session.addSpectator(conn)
+        return session
+
+    # Given an encoded message to deliver to a seat (and the time the move in it was received, if the relay is to be timed), pushes the message to the player's connection.
+    # A player whose connection has dropped is sent the moves they missed when they resume the game instead.
+    def _deliver(self, seat, data, receivedAt=None):
+        if seat.conn is not None and not seat.conn.sendEncoded(data, receivedAt):
+            print(f"Unable to send to {seat.username} - disconnecting")
+
+    # Given a session and a MoveDelta, encodes the delta once and sends it on to both seats and any spectators of the session.
+    # If the time the move was received is given, the relay of the move to the opponent is timed.
+    def _broadcast(self, session, username, delta, receivedAt=None):
+        data = encodeMsg(Msg(username, delta))
+        for seat in session.seats.values():
+            if not seat.left:
+                self._deliver(seat, data, receivedAt if seat.username != username else None)
+        session.publish(data)
+        if delta.winner != Game.ONGOING:
+            self.sessions.end(session)
+            self._gameEnded(session)
+
+    # Called once the game of a session has ended. Does nothing here, but is overridden by the workers of a sharded server to tell the router.
+    def _gameEnded(self, session):
+        pass
+
+    # Given the username and connection of a player and their move, plays the move on the player's game session and sends the resulting MoveDelta to both players.
+    # The move is only played if the player's seat is on the connection it was received on, so a client can't play moves for a seat which isn't its own.
+    # A move of (-1, -1), or a move which the server's game rejects, forfeits the game.
+    def _relayMove(self, username, conn, move):
+        receivedAt = time.perf_counter()
+        session = self.sessions.getByUsername(username)
+        if session is None:
+            return
+        row, col = move
+        with session.lock:
+            if session.getSeat(username).conn is not conn:
+                print(f"Rejected move {(row, col)} for {username} in game {session.gameId}: not sent from the player's connection")
+                return
+            if (row, col) == (-1, -1):
+                delta = session.forfeit(username)
+            else:
+                try:
+                    delta = session.play(username, row, col)
+                except GameError as e:
+                    print(f"Rejected move {(row, col)} from {username} in game {session.gameId}: {e}")
+                    delta = session.forfeit(username)
+            if delta is not None:
+                self._broadcast(session, username, delta, receivedAt)
+
+    # Given the username of a player who has left the server and the connection they left from, removes them from the matchmaking queue and from their game session.
+    # Only what is on that connection is removed (unless the connection is None, for a seat whose resume timeout has run out).
+    # If their game hasn't ended, they forfeit it so that their opponent is not left waiting for a move that won't come.
+    def _removeUser(self, username, conn):
+        self.matchmaker.leave(username, conn)
+        with self._lock:
+            if conn is not None and self.onlineUsers.get(username) is conn:
+                del self.onlineUsers[username]
+        session = self.sessions.leave(username, conn)
+        if session is not None:
+            with session.lock:
+                seat = session.getSeat(username)
+                if seat.resumeTimer is not None:
+                    seat.resumeTimer.cancel()
+                delta = session.forfeit(username)
+                if delta is not None:
+                    self._broadcast(session, username, delta)
+
+    # Given the username and connection of a player whose connection has dropped, removes them from the server.
+    # If they are in the middle of a game, their seat is kept for the resume timeout so that their client can resume the game, and they only forfeit the game if it doesn't.
+    def _disconnectUser(self, username, conn):
+        session = self.sessions.getByUsername(username)
+        if session is None or session.game.winner != Game.ONGOING or session.getSeat(username).conn is not conn:
+            self._removeUser(username, conn)
+            return
+        self.matchmaker.leave(username, conn)
+        with self._lock:
+            if self.onlineUsers.get(username) is conn:
+                del self.onlineUsers[username]
+        with session.lock:
+            seat = session.getSeat(username)
+            if seat.conn is not conn:
+                return
+            seat.conn = None
+            self._startResumeTimer(session, seat)
+
+    # Given a session and a seat with no connection, starts the seat's resume timeout, after which the player is removed from the game if they haven't resumed it.
+    def _startResumeTimer(self, session, seat):
+        seat.resumeTimer = threading.Timer(self._RESUME_TIMEOUT, self._expireSeat, args=(session, seat))
+        seat.resumeTimer.daemon = True
+        seat.resumeTimer.start()
+
+    # Called when the resume timeout of a disconnected seat runs out. If the player still hasn't resumed the game, they are removed from it.
+    def _expireSeat(self, session, seat):
+        with session.lock:
+            if seat.conn is None and not seat.left:
+                seat.resumeTimer = None
+                self._removeUser(seat.username, None)
+
+    # Given the username and new connection of a player resuming a game, along with the game id, their seat's token, and the sequence number of the last move their client received, moves their seat onto the new connection.
+    # The client is replied to with the number of moves the server has received from the player, so it can tell if its last move needs to be sent again, and then only the moves after the last one received are sent again.
+    # Returns True if the game was resumed, or False if there is no such game or the token is wrong.
+    def _resumeUser(self, username, conn, gameId, token, lastSeq):
+        session = self.sessions.get(gameId)
+        seat = session.getSeat(username) if session is not None else None
+        if seat is None or seat.left or not hmac.compare_digest(seat.token, token):
+            conn.send(Msg(None, None, args=gameId))
+            return False
+        with session.lock:
+            if seat.resumeTimer is not None:
+                seat.resumeTimer.cancel()
+                seat.resumeTimer = None
+            conn.send(Msg(None, seat.movesPlayed, args=gameId))
+            oldConn = seat.reconnect(conn, session.moveLog[lastSeq:])
+            with self._lock:
+                self.onlineUsers[username] = conn
+        if oldConn is not None:
+            oldConn.shutdown()
+        return True
+
+    # Given a message received from a client, returns if it has the form the server expects: a username as the sender, a move given as a row and column, and the right arguments for its command.
+    # Messages which don't are ignored, rather than letting them raise an error in the thread handling the client.
+    @staticmethod
+    def _isValidMsg(msg):
+        if not isinstance(msg, Msg) or not isinstance(msg.sender, str):
+            return False
+        if msg.receiver != None:
+            return isinstance(msg.data, (tuple, list)) and len(msg.data) == 2 and all(type(x) is int for x in msg.data)
+        if msg.data == Cmd.GETOPP:
+            return msg.args is None or type(msg.args) is int
+        if msg.data == Cmd.SPECTATE:
+            return type(msg.args) is int
+        if msg.data == Cmd.RESUME:
+            return isinstance(msg.args, tuple) and len(msg.args) == 3 and type(msg.args[0]) is int and isinstance(msg.args[1], str) and type(msg.args[2]) is int and msg.args[2] >= 0
+        return isinstance(msg.data, Cmd)
 
     # Called when a client message is received, and gives the appropriate response depending on the message.
+    # Replies, and the moves of the client's game, are pushed to the client through its connection's outbound queue, so reading the next message never waits on sending.
+    # A connection is tied to the username it was added (or resumed a game) with, and every later command acts for that username rather than the sender written in the message.
+    # If the client disconnects (or sends something which can't be read as a message), they are removed from the server, however the loop ends. A client which starts spectating is no longer listed as an online user, and a spectator's connection is only read from to detect the spectator leaving.
     def _handleClient(self, c):
-        while True:
-            recvMsg = c.recv(1024)
-            if not recvMsg:
-                break
-            msg = pickle.loads(recvMsg)
-            if msg.receiver != None and msg.receiver in self.onlineUsers:
-                self.onlineUsers[msg.receiver][2] = recvMsg
-            elif msg.data == Cmd.REM:
-                del self.onlineUsers[msg.sender]
-            elif msg.data == Cmd.ADD:
-                self.onlineUsers[msg.sender] = [c, None, None]
-                c.send(pickle.dumps("ACK"))
-            elif msg.data == Cmd.GETOPP:
-                self.onlineUsers[msg.sender][1] = False
-                self._getOpponent()
-            elif msg.data == Cmd.GETMOVE:
-                message = None
-                while not message:
-                    message = self.onlineUsers[msg.sender][2]
-                    time.sleep(0.1)
-                self.onlineUsers[msg.sender][0].send(message)
-                self.onlineUsers[msg.sender][2] = None
-        c.close()
+        conn = Connection(c, self.metrics)
+        with self._lock:
+            self.connections.add(conn)
+        username = None
+        spectating = None
+        try:
+            while True:
+                try:
+                    msg = recvMsg(c)
+                except Exception:
+                    msg = None
+                if msg is None:
+                    break
+                self.metrics.countMessage()
+                conn.touch()
+                if not Server._isValidMsg(msg):
+                    print(f"Ignored a malformed message from {username}")
+                    continue
+                if msg.receiver != None:
+                    if username is not None:
+                        self._relayMove(username, conn, msg.data)
+                elif msg.data == Cmd.REM:
+                    if username is not None:
+                        self._removeUser(username, conn)
+                    username = None
+                elif msg.data == Cmd.HEARTBEAT:
+                    conn.send(Msg(None, Cmd.HEARTBEAT))
+                elif msg.data == Cmd.ADD and spectating is None:
+                    username = msg.sender
+                    with self._lock:
+                        self.onlineUsers.setdefault(username, conn)
+                    conn.send(Msg(None, "ACK"))
+                elif msg.data == Cmd.GETOPP:
+                    if username is not None:
+                        self._getOpponent(username, conn, msg.args)
+                elif msg.data == Cmd.GETGAMES:
+                    conn.send(Msg(None, self._getGames()))
+                elif msg.data == Cmd.SPECTATE:
+                    if username is not None:
+                        self._removeUser(username, conn)
+                    username = None
+                    spectating = self._spectate(conn, msg.args)
+                elif msg.data == Cmd.RESUME and username is None and spectating is None:
+                    if self._resumeUser(msg.sender, conn, *msg.args):
+                        username = msg.sender
+        finally:
+            with self._lock:
+                self.connections.discard(conn)
+            try:
+                if username is not None:
+                    self._disconnectUser(username, conn)
+                if spectating is not None:
+                    spectating.removeSpectator(conn)
+            finally:
+                conn.close()
 
+# The server can be given a rank bucket size as a command line argument, in which case players are matched with others of a similar score.
 if __name__ == "__main__":
-    server = Server()
+    rankBucketSize = int(argv[1]) if len(argv) > 1 else None
+    server = Server(rankBucketSize)
     server.run()
\ No newline at end of file
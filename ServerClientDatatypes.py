@@ -1,12 +1,65 @@
 from enum import Enum
+import pickle
+import struct
 
 # The Msg class defines the datatype of messages sent between the client and server.
+# Any extra information needed by a command (e.g. the player's score when requesting an opponent) is sent as the args.
 class Msg:
 
-    def __init__(self, sender, data=None, receiver=None):
+    def __init__(self, sender, data=None, receiver=None, args=None):
         self.sender = sender
         self.data = data
         self.receiver = receiver
+        self.args = args
+
+# The MoveDelta class defines the datatype the server sends to clients for each move played in a game session.
+# It contains the change to the game state caused by the move: the pairs of pieces captured, and the winner of the game after the move.
+# A move of (-1, -1) means that the player forfeited the game (by quitting or by playing a move the server rejected).
+class MoveDelta:
+
+    def __init__(self, seq, row, col, player, capturedPairs, winner):
+        self.seq = seq
+        self.row = row
+        self.col = col
+        self.player = player
+        self.capturedPairs = capturedPairs
+        self.winner = winner
+
+    # Returns True if the move means that the player forfeited the game.
+    def isForfeit(self):
+        return (self.row, self.col) == (-1, -1)
 
 # The Cmd Enum class defines the datatype of commands which can be sent as the data of messages between the client and server.
-Cmd = Enum("Cmd", ["ADD", "GETOPP", "GETMOVE", "REM"])
\ No newline at end of file
+Cmd = Enum("Cmd", ["ADD", "GETOPP", "REM", "GETGAMES", "SPECTATE", "RESUME", "HEARTBEAT", "REDIRECT"])
+
+# Messages are sent as a pickled object prefixed by its length, so that messages sent one after the other are never merged or split.
+HEADER = struct.Struct("!I")
+
+# Given a message, returns the bytes which are sent over a socket to transfer it.
+def encodeMsg(msg):
+    data = pickle.dumps(msg)
+    return HEADER.pack(len(data)) + data
+
+# Sends a message over a socket.
+def sendMsg(s, msg):
+    s.sendall(encodeMsg(msg))
+
+# Given a socket and a number of bytes, reads exactly that many bytes from the socket, or returns None if the connection is closed.
+def _recvExactly(s, size):
+    data = b""
+    while len(data) < size:
+        chunk = s.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+# Receives a single message from a socket and returns it, or returns None if the connection is closed.
+def recvMsg(s):
+    header = _recvExactly(s, HEADER.size)
+    if header is None:
+        return None
+    data = _recvExactly(s, HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return pickle.loads(data)
\ No newline at end of file
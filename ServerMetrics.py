@@ -0,0 +1,135 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left
+import threading
+import time
+
+# The ServerMetrics class collects measurements of a running server: the number of messages received, the number of idle connections reaped, and a histogram of how long moves take to be relayed.
+# Together with the state of the server (connected users, active games, waiting players, and threads), these can be read from a small HTTP stats endpoint, and are printed in a periodic log line.
+class ServerMetrics:
+
+    # The upper bounds (in milliseconds) of the buckets of the relay latency histogram.
+    LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self, server):
+        self._server = server
+        self._lock = threading.Lock()
+        self._startTime = time.time()
+        self._messages = 0
+        self._reaped = 0
+        self._lastSamples = {}
+        self._latencyCounts = [0 for _ in range(len(ServerMetrics.LATENCY_BUCKETS)+1)]
+        self._latencyTotal = 0.0
+
+    # Records that a message has been received from a client.
+    def countMessage(self):
+        with self._lock:
+            self._messages += 1
+
+    # Records that an idle connection has been shut down by the reaper.
+    def countReaped(self):
+        with self._lock:
+            self._reaped += 1
+
+    # Given the time (in seconds) taken between the server receiving a move and sending it on to the opponent, adds it to the relay latency histogram.
+    def recordRelay(self, seconds):
+        bucket = bisect_left(ServerMetrics.LATENCY_BUCKETS, seconds*1000)
+        with self._lock:
+            self._latencyCounts[bucket] += 1
+            self._latencyTotal += seconds
+
+    # Given the name of what the stats are being read for (such as the log line or the stats endpoint), returns the number of messages received per second since the last time they were read for it.
+    # Each reader keeps its own last sample, so reading the stats for one doesn't change the rate reported to another.
+    def _sampleMessageRate(self, reader):
+        now = time.time()
+        with self._lock:
+            lastTime, lastMessages = self._lastSamples.get(reader, (self._startTime, 0))
+            self._lastSamples[reader] = (now, self._messages)
+            return (self._messages - lastMessages) / (now - lastTime) if now > lastTime else 0.0
+
+    # Given a percentage, returns an estimate of the relay latency (in milliseconds) at that percentile, given as the upper bound of the histogram bucket it falls in.
+    def _latencyPercentile(self, p):
+        total = sum(self._latencyCounts)
+        if total == 0:
+            return None
+        cumulative = 0
+        for i, count in enumerate(self._latencyCounts):
+            cumulative += count
+            if cumulative >= p/100 * total:
+                return ServerMetrics.LATENCY_BUCKETS[i] if i < len(ServerMetrics.LATENCY_BUCKETS) else float("inf")
+
+    # Given the name of what the stats are being read for, returns a dictionary of the current measurements and the state of the server.
+    def getStats(self, reader="stats"):
+        messagesPerSecond = self._sampleMessageRate(reader)
+        with self._lock:
+            relays = sum(self._latencyCounts)
+            return {
+                "uptime_seconds": round(time.time() - self._startTime),
+                "connected_users": len(self._server.onlineUsers),
+                "open_connections": len(self._server.connections),
+                "active_games": len(self._server.sessions),
+                "waiting_players": len(self._server.matchmaker),
+                "threads": threading.active_count(),
+                "messages_total": self._messages,
+                "messages_per_second": round(messagesPerSecond, 2),
+                "reaped_connections_total": self._reaped,
+                "relays_total": relays,
+                "relay_latency_mean_ms": round(1000*self._latencyTotal/relays, 2) if relays else None,
+                "relay_latency_p50_ms": self._latencyPercentile(50),
+                "relay_latency_p99_ms": self._latencyPercentile(99),
+            }
+
+    # Given the name of what the stats are being read for, returns the stats as text, with one "name value" pair on each line followed by the relay latency histogram.
+    def getStatsText(self, reader="stats"):
+        lines = [f"{name} {value}" for name, value in self.getStats(reader).items()]
+        with self._lock:
+            cumulative = 0
+            for bound, count in zip(ServerMetrics.LATENCY_BUCKETS + ["+Inf"], self._latencyCounts):
+                cumulative += count
+                lines.append(f'relay_latency_ms_bucket{{le="{bound}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+    # Returns a single line summarising the stats, which is printed periodically by the server.
+    def getLogLine(self):
+        stats = self.getStats("log")
+        return (f"[{time.strftime('%H:%M:%S')}] users: {stats['connected_users']}, games: {stats['active_games']}, waiting: {stats['waiting_players']}, "
+                f"threads: {stats['threads']}, messages/s: {stats['messages_per_second']}, relay p50/p99: {stats['relay_latency_p50_ms']}/{stats['relay_latency_p99_ms']}ms")
+
+    # Given a number of seconds, starts a thread which prints the log line every interval.
+    def startLogging(self, interval):
+        def log():
+            while True:
+                time.sleep(interval)
+                print(self.getLogLine())
+        threading.Thread(target=log, daemon=True).start()
+
+    # Given a host and port, starts a thread running an HTTP server which responds to GET /stats with the stats text and GET /health with OK.
+    # If the port can't be used, a message is printed and the server runs without the stats endpoint.
+    def startEndpoint(self, host, port):
+        metrics = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    body = metrics.getStatsText("endpoint")
+                elif self.path == "/health":
+                    body = "OK\n"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            # Stops each request being logged to the terminal.
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            httpServer = ThreadingHTTPServer((host, port), StatsHandler)
+        except OSError as e:
+            print(f"Unable to start the stats endpoint on port {port}: {e}")
+            return
+        threading.Thread(target=httpServer.serve_forever, daemon=True).start()
+        print(f"Stats available at http://{host}:{port}/stats")
\ No newline at end of file
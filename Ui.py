@@ -1,24 +1,18 @@
-from copy import deepcopy
-from Game import Game, GameError, GameRecord, MoveStack
+from copy import copy, deepcopy
+from Game import Game, GameError, GameRecord, Player, Mode
 from colorama import Fore, Style
-from enum import Enum
 from datetime import datetime
 import Database
 import Ai
 from tkinter import *
 from tkinter import ttk
 from functools import partial
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageTk
 from Client import Client
+from DatabaseWriter import DatabaseWriter
 import threading
 import getpass
 
-# The Player Enum class defines different player types.
-Player = Enum("Player", ["MAIN", "OPP", "GUEST", "COMP"])
-
-# The Mode Enum class defines different playing modes.
-Mode = Enum("Mode", ["PVP", "COMP", "LAN"])
-
 # The Ui class contains attributes and methods shared by the two Uis: Terminal and Gui.
 # Ui subclasses are run via the run method.
 class Ui:
@@ -29,6 +23,7 @@ class Ui:
         self._currPlayers = {Game.P1: Player.MAIN, Game.P2: Player.OPP}
         self._currGameRecord = None
         self._client = None
+        self._pendingSaves = {}
 
     @property
     def player(self):
@@ -85,7 +80,7 @@ class Ui:
     # Given a gameRecord (of the GameRecord datatype), returns a string summarising the information in the gameRecord.
     @staticmethod
     def _gameString(gameRecord):
-        players = [Database.getPlayerGameUsername(gameRecord.id, Game.P1), Database.getPlayerGameUsername(gameRecord.id, Game.P2)]
+        players = list(gameRecord.players)
         for i in range(2):
             if players[i] == False:
                 if gameRecord.mode == Mode.COMP:
@@ -94,37 +89,91 @@ class Ui:
                     players[i] = "Guest"
         mode = f"{players[0]} v.s. {players[1]}"
         whenSaved = datetime.strftime(gameRecord.whenSaved, "%d/%m/%Y, %H:%M:%S")
-        if gameRecord.game.winner == Game.P1:
+        if gameRecord.winner == Game.P1:
             status = "P1 won"
-        elif gameRecord.game.winner == Game.P2:
+        elif gameRecord.winner == Game.P2:
             status = "P2 won"
-        elif gameRecord.game.winner == Game.DRAW:
+        elif gameRecord.winner == Game.DRAW:
             status = "Draw"
         else:
             status = "ONGOING"
         return f"{gameRecord.name} - players: {mode}, saved on: {whenSaved}, status: {status}"
 
-    # Given the username of a player, adds the player's result to their player profile by calling the database's addPlayerResult procedure.
-    def _addUserResult(self, player):
+    # Given the username of a player, returns the player's result in the current game: True if they won, False if they lost, or -1 for a draw.
+    def _getUserResult(self, player):
         if self.currGameRecord.game.winner == Game.DRAW:
-            Database.addPlayerResult(player, -1)
-        elif player == self._getUsernameOfPlayerNumber(self.currGameRecord.game.winner):
-            Database.addPlayerResult(player, True)
+            return -1
+        return player == self._getUsernameOfPlayerNumber(self.currGameRecord.game.winner)
+
+    # Given a function which writes to the database and the arguments to call it with, runs the write, and then the callback (if given) with the result of the function.
+    # If the write fails, the onError callback (if given) is run with the error, which is raised otherwise.
+    # Writes are run straight away by default; the GUI runs them on its database writer thread instead.
+    def _write(self, function, *args, key=None, callback=None, onError=None):
+        try:
+            result = function(*args)
+        except Exception as e:
+            if onError is None:
+                raise
+            onError(e)
+            return
+        if callback is not None:
+            callback(result)
+
+    # Returns a copy of the current game record with its own copy of the game, so it can be written to the database while the game carries on being played.
+    def _snapshotGameRecord(self):
+        snapshot = copy(self.currGameRecord)
+        snapshot.game = deepcopy(self.currGameRecord.game)
+        return snapshot
+
+    # Given a game record, returns a list holding the id it has been saved with (or -1 if it hasn't been saved), which is passed to the writes which save the game.
+    # While a new game is being saved, the list is shared by every write of the game and filled in by the write which saves it, so that the writes queued after it update the saved game instead of saving it again.
+    def _getSavedId(self, gameRecord):
+        return self._pendingSaves.get(id(gameRecord), [gameRecord.id])
+
+    # Given a game record, returns if it has been saved (or is being saved) to the database.
+    def _isSaved(self, gameRecord):
+        return gameRecord.id != -1 or id(gameRecord) in self._pendingSaves
+
+    # Given the usernames of player 1 and 2, a snapshot of a game record, and the list holding the id the game has been saved with, saves the snapshot by calling the database's saveGame function if the game hasn't been saved yet, or its updateGame procedure if it has.
+    # Returns the id of the saved game.
+    @staticmethod
+    def _writeGame(username1, username2, snapshot, savedId):
+        if savedId[0] == -1:
+            savedId[0] = Database.saveGame(username1, username2, snapshot)
         else:
-            Database.addPlayerResult(player, False)
-
-    # Adds each player's result to their profile by calling the addUserResult procedure, and returns if any changes were made.
-    def _addResultsToProfile(self):
-        changesMade = False
-        for player in [self.player, self.opponent]:
-            if player in [Player.COMP, Player.GUEST]: continue
-            changesMade = True
-            self._addUserResult(player)
-        return changesMade
-
-    # When loading a game, finds from the database which player played as which player number and returns the main player (one of P1 and P2)
+            snapshot.id = savedId[0]
+            Database.updateGame(snapshot)
+        return savedId[0]
+
+    # Given the results of a game, a snapshot of its game record, and the list holding the id the game has been saved with, records the results by calling the database's recordGameResult procedure, along with the snapshot if the game has been saved.
+    # Returns if the saved game was updated.
+    @staticmethod
+    def _recordGameResult(results, snapshot, savedId):
+        if savedId[0] == -1:
+            Database.recordGameResult(results)
+            return False
+        snapshot.id = savedId[0]
+        Database.recordGameResult(results, snapshot)
+        return True
+
+    # Given the username of a player, adds the player's result to their player profile by calling the database's addPlayerResult procedure.
+    def _addUserResult(self, player):
+        self._write(Database.addPlayerResult, player, self._getUserResult(player))
+
+    # Adds each player's result to their profile, and returns if any changes were made.
+    # If the game is a saved game, its saved time is updated and it is saved along with the results, all in one transaction. Once this has been written, the callback (if given) is run with whether the saved game was updated.
+    def _addResultsToProfile(self, callback=None):
+        results = [(player, self._getUserResult(player)) for player in [self.player, self.opponent] if player not in [Player.COMP, Player.GUEST]]
+        if not results:
+            return False
+        if self._isSaved(self.currGameRecord):
+            self.currGameRecord.whenSaved = datetime.now()
+        self._write(Ui._recordGameResult, results, self._snapshotGameRecord(), self._getSavedId(self.currGameRecord), callback=callback)
+        return True
+
+    # When loading a game, finds from the players of the game record which player played as which player number and returns the main player (one of P1 and P2)
     def _loadPlayers(self):
-        players = [Database.getPlayerGameUsername(self.currGameRecord.id, Game.P1), Database.getPlayerGameUsername(self.currGameRecord.id, Game.P2)]
+        players = self.currGameRecord.players
         mainPlayerPos = None
         for i, player in enumerate(players):
             pos = Game.P1 if i == 0 else Game.P2
@@ -137,29 +186,12 @@ class Ui:
         return mainPlayerPos
 
     # Writes the moves of a given game to a text file (with a given gameRecord) using Pente notation.
+    # The game is loaded from the database, as the game records listed to the user are summaries which don't include the game.
     @staticmethod
     def _exportGameMoves(gameRecord):
-        boardsize = len(gameRecord.game.board)
-        reverseMoveStack = MoveStack()
-        moveStackCopy = deepcopy(gameRecord.game.moveStack)
-        while not moveStackCopy.isEmpty():
-            lastStack = moveStackCopy.pop()
-            reverseMoveStack.push(lastStack[0], lastStack[1], lastStack[2])
-        moveRecord = ""
-        isPlayer1Turn = True
-        lastCaptures = {Game.P1: [], Game.P2: []}
-        while not reverseMoveStack.isEmpty():
-            captures, row, col = reverseMoveStack.pop()
-            capturesMade = True if lastCaptures != captures else False
-            moveRecord += Game.getPenteMoveNotation(row, col, boardsize, capturesMade)
-            if isPlayer1Turn:
-                moveRecord += " "
-            else:
-                moveRecord += "\n"
-            isPlayer1Turn = not isPlayer1Turn
-            lastCaptures = captures
+        game = Database.getGame(gameRecord.id).game
         with open(gameRecord.name+"_moveRecord"+".txt", "w+") as f:
-            f.write(moveRecord)
+            game.writePenteNotation(f)
 
     # Returns a string containing the rules of Pente
     @staticmethod
@@ -224,6 +256,9 @@ class Gui(Ui):
         self._headLabel.grid(row=0, column=0, sticky="NESW")
 
         self._playerNoPlayingLabel = None
+        self._spriteCache = {}
+        self._sprites = None
+        self._databaseWriter = DatabaseWriter(lambda callback: self.root.after(0, callback))
 
         self._c = Canvas()
         self._p1CapLabel = Label(self.gameFrame, relief="ridge", font=("Helvetica", 18))
@@ -343,9 +378,27 @@ class Gui(Ui):
     def playerNoPlayingLabel(self, playerNoPlayingLabel):
         self._playerNoPlayingLabel = playerNoPlayingLabel
 
+    @property
+    def databaseWriter(self):
+        return self._databaseWriter
+
     # Starts running the GUI by calling Tkinter's mainloop subroutine.
+    # Once the GUI has been closed, the client's connection to the server (if there is one) is closed, so its heartbeats don't keep an abandoned connection alive, and any writes to the database which are still queued are run before returning.
     def run(self):
         self.root.mainloop()
+        if self.client is not None:
+            self.client.closeConnection()
+        self.databaseWriter.close()
+
+    # Given a function which writes to the database and the arguments to call it with, queues the write on the database writer, so that the GUI doesn't wait for it to be committed.
+    # The callback (if given) is run on the Tkinter main loop once the write has been run, or the onError callback (if given) if the write fails.
+    def _write(self, function, *args, key=None, callback=None, onError=None):
+        self.databaseWriter.submit(function, *args, key=key, callback=callback, onError=onError)
+
+    # Given a function which reads from the database, the arguments to call it with, and a callback, queues the read on the database writer behind the writes already queued, so that it sees what they write without the GUI waiting for them.
+    # The callback is run on the Tkinter main loop with the result of the function.
+    def _read(self, function, *args, callback):
+        self.databaseWriter.submit(function, *args, callback=callback)
 
     # Creates a window which displays the rules of the game.
     def _createDisplayRulesWin(self):
@@ -436,13 +489,13 @@ class Gui(Ui):
             comboBox.grid(row=1, column=0, padx=10, pady=5)
             Button(loadGameWindow, text="Load game", command=partial(self._loadGame, loadGameWindow, comboBox, games)).grid(row=2, column=0, padx=10, pady=5)
 
-    # Given the game information of the game being loaded, accesses the database for the game record of the game being loaded by calling the database's loadGames function, and calls the playGame procedure to start the game.
+    # Given the game information of the game being loaded, accesses the database for the game record of the game being loaded by calling the database's getGame function, and calls the playGame procedure to start the game.
     def _loadGame(self, loadGameWindow, comboBox, games):
         gameInfo = comboBox.get()
         for gameRecord in games:
             if Ui._gameString(gameRecord) == gameInfo:
                 break
-        self.currGameRecord = gameRecord
+        self.currGameRecord = Database.getGame(gameRecord.id)
         mainPlayerPos = self._loadPlayers()
         loadGameWindow.destroy()
         self._playGame(mainPlayerPos, new=False)
@@ -490,16 +543,40 @@ class Gui(Ui):
         Button(saveGameWindow, text="Confirm", command=partial(self._saveGame, saveGameWindow, gameNameEntry, statusLabel)).grid(row=5, column=0, columnspan=2, pady=10)
 
     # Given a game name, calls the database's saveGame procedure to save the contents of the current game information with the game name to the database.
+    # Until the game has been saved, it is recorded as a pending save, so saving it again (or recording its result) updates the game once it has been saved rather than saving it twice.
     def _saveGame(self, saveGameWindow, gameNameEntry, statusLabel):
         gameName = gameNameEntry.get()
         if gameName == "":
             statusLabel.config(text="Please enter a name to save the game as")
         else:
             self.currGameRecord.whenSaved, self.currGameRecord.name = datetime.now(), gameName
-            p1 = self._getUsernameOfPlayerNumber(Game.P1)
-            p2 = self._getUsernameOfPlayerNumber(Game.P2)
-            self.currGameRecord.id = Database.saveGame(p1, p2, self.currGameRecord)
+            self._pendingSaves[id(self.currGameRecord)] = [-1]
+            self._writeCurrentGame(partial(self._gameSaved, self.currGameRecord))
             saveGameWindow.destroy()
+            self._updateOptionFrame()
+
+    # Given a callback, queues a write of a snapshot of the current game, which saves the game if it hasn't been saved or updates the saved game otherwise.
+    # Every write of the same game record shares one key, so saving the game again before the last save has been written replaces it. The callback is run with the id of the saved game.
+    def _writeCurrentGame(self, callback):
+        p1 = self._getUsernameOfPlayerNumber(Game.P1)
+        p2 = self._getUsernameOfPlayerNumber(Game.P2)
+        self._write(Ui._writeGame, p1, p2, self._snapshotGameRecord(), self._getSavedId(self.currGameRecord), key=("saveGame", id(self.currGameRecord)), callback=callback, onError=partial(self._gameNotSaved, self.currGameRecord))
+
+    # Run once a game has been saved to the database, given its game record and the id it was saved with.
+    # The id is given to the game record here, on the Tkinter main loop, and the game is no longer a pending save. If the game is still being played, the option frame is updated.
+    def _gameSaved(self, gameRecord, gameId):
+        gameRecord.id = gameId
+        self._pendingSaves.pop(id(gameRecord), None)
+        if self.playing and self.currGameRecord is gameRecord:
+            self._updateOptionFrame()
+            self._updateState()
+
+    # Run if saving a game to the database fails, given its game record and the error. The game is no longer a pending save, so it keeps the id it had before (-1 if it had never been saved), and the user is told the game wasn't saved.
+    def _gameNotSaved(self, gameRecord, error):
+        self._pendingSaves.pop(id(gameRecord), None)
+        if self.playing and self.currGameRecord is gameRecord:
+            self._updateOptionFrame()
+        self._createNotificationWin("Game not saved", f"Unable to save your game: {error}")
 
     # Creates a window allowing the user to enter a username and password with which to create a new account.
     def _createAccountWindow(self):
@@ -520,6 +597,7 @@ class Gui(Ui):
         Button(createAccountWindow, text="Confirm", command=partial(self._createAccount, createAccountWindow, usernameEntry, passwordEntry1, passwordEntry2, statusLabel)).grid(row=4, column=0, columnspan=2, pady=10)
 
     # Given a username and password, creates a new account by creating a new entry in the database's Player table by calling its savePlayer procedure.
+    # The account is saved on the database writer, as hashing the password takes a noticeable amount of time, and the user is logged in once it has been saved.
     def _createAccount(self, createAccountWindow, usernameEntry, passwordEntry1, passwordEntry2, statusLabel):
         username, password1, password2 = usernameEntry.get(), passwordEntry1.get(), passwordEntry2.get()
         if username == "" or password1 == "" or password2 == "":
@@ -529,13 +607,23 @@ class Gui(Ui):
         elif password1 != password2:
             statusLabel.config(text="Error: passwords do not match")
         else:
-            Database.savePlayer(username, password1, datetime.now())
-            self.player = username
-            self._updateMenuFrame()
-            self._updateHeadLabel()
-            self._updateOptionFrame()
+            statusLabel.config(text="Creating account...")
+            self._write(Database.savePlayer, username, password1, datetime.now(), callback=partial(self._accountCreated, createAccountWindow, username), onError=partial(self._writeFailed, createAccountWindow, statusLabel, "Unable to create the account"))
+
+    # Run once a new account has been saved to the database, given the create account window and the account's username. Logs the user in to the new account.
+    def _accountCreated(self, createAccountWindow, username, result):
+        self.player = username
+        self._updateMenuFrame()
+        self._updateHeadLabel()
+        self._updateOptionFrame()
+        if createAccountWindow.winfo_exists():
             createAccountWindow.destroy()
 
+    # Run if a write started from a window fails, given the window, its status label, a message, and the error. The message and error are displayed on the status label (if the window is still open).
+    def _writeFailed(self, window, statusLabel, message, error):
+        if window.winfo_exists():
+            statusLabel.config(text=f"{message}: {error}")
+
     # Undoes the last move in the currently being played game, and displays an error if not possible.
     def _undo(self):
         if not self.playing:
@@ -575,7 +663,7 @@ class Gui(Ui):
                 else:
                     Label(self.optionFrame, text="YOU ARE PLAYER 2").grid(row=6, column=0, padx=10, pady=5)
             if self.player != Player.GUEST or (self.opponent not in [Player.GUEST, Player.COMP]):
-                if self.currGameRecord.id == -1:
+                if not self._isSaved(self.currGameRecord):
                     command = self._createSaveGameWindow
                 else:
                     command = self._createSavedGameConfirmationWindow
@@ -608,10 +696,15 @@ class Gui(Ui):
         self._updateOptionFrame()
         self._updateState()
 
-    # Updates the game by calling the database's updateGame procedure, and creates a notification window to notify the user that the game was updated.
+    # Updates the saved game by calling the database's updateGame procedure, and creates a notification window to notify the user once the game has been updated.
+    # Saving the same game again before the update has been written replaces the update.
     def _createSavedGameConfirmationWindow(self):
         self.currGameRecord.whenSaved = datetime.now()
-        Database.updateGame(self.currGameRecord)
+        self._writeCurrentGame(partial(self._gameUpdated, self.currGameRecord))
+
+    # Run once a saved game has been updated, given its game record and id. Creates a notification window to notify the user.
+    def _gameUpdated(self, gameRecord, gameId):
+        self._gameSaved(gameRecord, gameId)
         self._createNotificationWin("Game saved", "Your game has been saved")
     
     # Updates how the menu frame is displayed (the left-most frame in the GUI) depending on whether the user is logged in or not.
@@ -631,16 +724,22 @@ class Gui(Ui):
             Button(self.menuFrame, text="View profile", command=self._createViewProfileWindow).grid(row=4, column=0, padx=10, pady=5)
             Button(self.menuFrame, text="Logout", command=self._logout).grid(row=5, column=0, padx=10, pady=5)
 
-    # Creates a window which allows the user to view their player profile.
+    # Given a username, returns the player's profile, their number of saved games and ongoing saved games, and their rank, as read from the database.
+    @staticmethod
+    def _getProfile(username):
+        return Database.getPlayer(username), Database.countGames(username), Database.countGames(username, Game.ONGOING), Database.getPlayerRank(username)
+
+    # Creates a window which allows the user to view their player profile, once the profile has been read from the database.
     def _createViewProfileWindow(self):
+        self._read(self._getProfile, self.player, callback=partial(self._displayProfile, self.player))
+
+    # Given a username and the profile read by getProfile, creates a window displaying the player's profile.
+    def _displayProfile(self, username, profile):
+        (whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score), numberOfSavedGames, numberOfOngoings, rank = profile
+        totalNumberOfGames = sum([numberOfWins, numberOfLosses, numberOfDraws])
         viewProfileWindow = Toplevel(self.root)
         viewProfileWindow.title("View profile")
-        whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score = Database.getPlayer(self.player)
-        numberOfSavedGames = len(Database.loadAllGames(self.player))
-        numberOfOngoings = len(Database.loadGames(self.player, Game.ONGOING))
-        totalNumberOfGames = sum([numberOfWins, numberOfLosses, numberOfDraws])
-        rank = Database.getPlayerRank(self.player)
-        Label(viewProfileWindow, text=f"{self.player}'s profile:").grid(row=0, column=0, padx=10, pady=10)
+        Label(viewProfileWindow, text=f"{username}'s profile:").grid(row=0, column=0, padx=10, pady=10)
         Label(viewProfileWindow, text=f"Number of finished games: {totalNumberOfGames}").grid(row=1, column=0, padx=10, pady=5)
         Label(viewProfileWindow, text=f"Number of won games: {numberOfWins}").grid(row=2, column=0, padx=10, pady=5)
         Label(viewProfileWindow, text=f"Number of lost games: {numberOfLosses}").grid(row=3, column=0, padx=10, pady=5)
@@ -652,9 +751,12 @@ class Gui(Ui):
         Label(viewProfileWindow, text=f"Profile created on {datetime.strftime(whenSaved, '%d/%m/%Y, %H:%M:%S')}").grid(row=9, column=0, padx=10, pady=10)
         Button(viewProfileWindow, text="Ok", command=viewProfileWindow.destroy).grid(row=10, column=0, padx=10, pady=5)
     
-    # Creates a window which allows the user to view their saved games, and to decide whether to load or delete any games.
+    # Creates a window which allows the user to view their saved games, and to decide whether to load or delete any games, once the games have been read from the database.
     def _createViewGamesWindow(self):
-        games = Database.loadAllGames(self.player)
+        self._read(Database.loadAllGames, self.player, callback=self._displayGames)
+
+    # Given the summaries of the user's saved games, creates a window listing them (or notifies the user if there are none).
+    def _displayGames(self, games):
         if not games:
             self._createNotificationWin("View games", "There are no games to view.")
         else:
@@ -712,9 +814,8 @@ class Gui(Ui):
         for gameRecord in games:
             if Ui._gameString(gameRecord) == gameInfo:
                 break
-        Database.deleteGame(gameRecord.id)
+        self._write(Database.deleteGame, gameRecord.id, callback=lambda result: self._createNotificationWin("Game deleted", f"Game {gameRecord.name} successfully deleted."))
         deleteGameWindow.destroy()
-        self._createNotificationWin("Game deleted", f"Game {gameRecord.name} successfully deleted.")
 
     # Creates a window asking for the user's confirmation to quit the currently being played game.
     def _confirmQuit(self):
@@ -734,16 +835,11 @@ class Gui(Ui):
     # Quits the currently being played game and updates the GUI display appropriately.
     def _quitGame(self, confirmQuitWindow):
         if self.currGameRecord.mode == Mode.LAN and self.playing:
-            if not self.client.requestingMove:
-                self.client.makeMove((-1, -1))
-                self.client.closeConnection()
-                if self.playing:
-                    self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.OPP else Game.P2
-                self._addUserResult(self.player)
-                self._createNotificationWin("Profile updated", "Your profile has been updated with the game result.")
-            else:
-                self._createNotificationWin("Quit Error", "You can only quit on your turn", confirmQuitWindow)
-                return
+            self.client.makeMove((-1, -1))
+            self.client.closeConnection()
+            self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.OPP else Game.P2
+            self._addUserResult(self.player)
+            self._createNotificationWin("Profile updated", "Your profile has been updated with the game result.")
         self.playing = False
         self._updateGameFrame()
         self._updateOptionFrame()
@@ -772,19 +868,27 @@ class Gui(Ui):
         Button(loginWindow, text="Confirm", command=partial(self._login, loginWindow, player, usernameEntry, passwordEntry, statusLabel, toplevel)).grid(row=3, column=0, columnspan=2, pady=10)
 
     # Given a username and password, logs the user in by calling the database's checkPassword function to check that the username and passwords match.
+    # The password is checked on the database writer (which also runs the upgrade of a legacy password hash), as hashing the password takes a noticeable amount of time.
     def _login(self, loginWindow, player, usernameEntry, passwordEntry, statusLabel, toplevel):
         username, password = usernameEntry.get(), passwordEntry.get()
-        if Database.checkPassword(username, password):
-                if player == Player.MAIN:
-                    self.player = username
-                    self._updateMenuFrame()
-                else:
-                    self.opponent = username
-                if self.playing:
-                    self._updateHeadLabel()
-                    self._updateOptionFrame()
-                loginWindow.destroy()
-                if player == Player.OPP: self._choosePlayer(toplevel, Mode.PVP)
+        statusLabel.config(text="Logging in...")
+        self._write(Database.checkPassword, username, password, callback=partial(self._passwordChecked, loginWindow, player, username, statusLabel, toplevel), onError=partial(self._writeFailed, loginWindow, statusLabel, "Unable to log in"))
+
+    # Run once the password entered in the login window has been checked, given whether it is correct. Logs the user in if it is, and tells them it isn't otherwise.
+    def _passwordChecked(self, loginWindow, player, username, statusLabel, toplevel, correct):
+        if not loginWindow.winfo_exists():
+            return
+        if correct:
+            if player == Player.MAIN:
+                self.player = username
+                self._updateMenuFrame()
+            else:
+                self.opponent = username
+            if self.playing:
+                self._updateHeadLabel()
+                self._updateOptionFrame()
+            loginWindow.destroy()
+            if player == Player.OPP: self._choosePlayer(toplevel, Mode.PVP)
         else:
             statusLabel.config(text="Incorrect username or password")
 
@@ -810,7 +914,7 @@ class Gui(Ui):
         self.currentBoard = [[Game.EMPTY for _ in range(gridsize)] for _ in range(gridsize)]
         canvasSize = self.MAX_CANVAS_SIZE - (self.MAX_CANVAS_SIZE%gridsize)
         squareSize = canvasSize//(gridsize+1)
-        self._createImages(squareSize)
+        self._sprites = self._getSprites(squareSize)
         self._updateOptionFrame()
         self._updateGameFrame(squareSize, canvasSize, gridsize)
         if self.currGameRecord.mode == Mode.LAN:
@@ -818,54 +922,53 @@ class Gui(Ui):
                 self._play(gridsize//2, gridsize//2)
                 self._updateState()
                 self.client.makeMove((gridsize//2, gridsize//2))
-            x = threading.Thread(target=self._lanGetDisplayMove)
-            x.start()
+            self.client.setMoveCallback(lambda delta: self.root.after(0, self._lanDisplayMove, delta))
         else:
             self._play(gridsize//2, gridsize//2)
             self._updateState()
             if self._getUsernameOfPlayerNumber(self.currGameRecord.game.player) == Player.COMP:
                 self._playComputer()
 
-    # Calls functions which create the images for the empty board cells and the player pieces.
-    def _createImages(self, squareSize):
-        self._createEmptyCellImage(squareSize)
-        self._createPlayerImage(squareSize, "red", "player1.png")
-        self._createPlayerImage(squareSize, "blue", "player2.png")
-        self._createMarkedPlayerImage(squareSize, "red", "player1Marked.png")
-        self._createMarkedPlayerImage(squareSize, "blue", "player2Marked.png")
-
-    # Draws an image of an empty cell.
+    # Given the size of a board square, returns the images for the empty board cells and the player pieces (marked and unmarked) at that size, as a dictionary from the piece and whether it is marked to the Tkinter image.
+    # The images are drawn and converted into Tkinter images the first time each size is used, and are kept in the sprite cache to be reused for every cell after that.
+    def _getSprites(self, squareSize):
+        if squareSize not in self._spriteCache:
+            self._spriteCache[squareSize] = {
+                (Game.EMPTY, False): ImageTk.PhotoImage(self._createEmptyCellImage(squareSize)),
+                (Game.P1, False): ImageTk.PhotoImage(self._createPlayerImage(squareSize, "red")),
+                (Game.P2, False): ImageTk.PhotoImage(self._createPlayerImage(squareSize, "blue")),
+                (Game.P1, True): ImageTk.PhotoImage(self._createMarkedPlayerImage(squareSize, "red")),
+                (Game.P2, True): ImageTk.PhotoImage(self._createMarkedPlayerImage(squareSize, "blue")),
+            }
+        return self._spriteCache[squareSize]
+
+    # Draws and returns an image of an empty cell.
     def _createEmptyCellImage(self, squareSize):
         img = Image.new("RGBA", (squareSize+6, squareSize+6), (255, 0, 0, 0))
         draw = ImageDraw.Draw(img)
         draw.line((img.size[0]/2, 0, img.size[0]/2, img.size[1]), fill="black")
         draw.line((0, img.size[1]/2, img.size[0], img.size[1]/2), fill="black")
-        img.save("emptyCell.png", "PNG")
+        return img
 
-    # Draws an image of a player piece of a specified colour.
-    def _createPlayerImage(self, squareSize, colour, name):
-        img = Image.new("RGBA", (squareSize+6, squareSize+6), (255, 0, 0, 0))
+    # Draws and returns an image of a player piece of a specified colour.
+    def _createPlayerImage(self, squareSize, colour):
+        img = self._createEmptyCellImage(squareSize)
         draw = ImageDraw.Draw(img)
-        draw.line((img.size[0]/2, 0, img.size[0]/2, img.size[1]), fill="black")
-        draw.line((0, img.size[1]/2, img.size[0], img.size[1]/2), fill="black")
         draw.ellipse((img.size[0]/4, img.size[1]/4, img.size[0]*3/4, img.size[1]*3/4), fill=colour, outline="black")
-        img.save(name, "PNG")
+        return img
 
-    # Draws an image of a player piece of a specified colour with black mark to indicate it was the last piece played.
-    def _createMarkedPlayerImage(self, squareSize, colour, name):
-        img = Image.new("RGBA", (squareSize+6, squareSize+6), (255, 0, 0, 0))
+    # Draws and returns an image of a player piece of a specified colour with black mark to indicate it was the last piece played.
+    def _createMarkedPlayerImage(self, squareSize, colour):
+        img = self._createPlayerImage(squareSize, colour)
         draw = ImageDraw.Draw(img)
-        draw.line((img.size[0]/2, 0, img.size[0]/2, img.size[1]), fill="black")
-        draw.line((0, img.size[1]/2, img.size[0], img.size[1]/2), fill="black")
-        draw.ellipse((img.size[0]/4, img.size[1]/4, img.size[0]*3/4, img.size[1]*3/4), fill=colour, outline="black")
         draw.ellipse((img.size[0]*7/16, img.size[1]*7/16, img.size[0]*9/16, img.size[1]*9/16), fill="black", outline="black")
-        img.save(name, "PNG")
+        return img
 
     # Creates a 2D array of Button objects which are positioned on the board.
     # Clicking a button indicates the user wants to place a piece at that position on the board.
     # When a button is pressed, the place function is called with the button position on the board passed in as arguments.
     def _getButtons(self, squareSize, gridsize):
-        photoImg = PhotoImage(file="emptyCell.png")
+        photoImg = self._sprites[(Game.EMPTY, False)]
         buttons = [[Button(self.gameFrame, width = squareSize, height = squareSize, image = photoImg, bg = "white", relief = FLAT, command = partial(self._place, y, x)) for x in range(gridsize)] for y in range(gridsize)]
         for y, buttonRow in enumerate(buttons):
             for x, button in enumerate(buttonRow):
@@ -893,8 +996,6 @@ class Gui(Ui):
                 self.client.makeMove((row, col))
                 self._play(row, col)
                 self._updateState()
-                x = threading.Thread(target=self._lanGetDisplayMove)
-                x.start()
             else:
                 self._play(row, col)
                 self._updateState()
@@ -902,41 +1003,47 @@ class Gui(Ui):
                     self.root.after(1, self._playComputer)
             
 
-    # Called after a user playing Player v.s. Player LAN places a piece on the board.
-    # Gets the move from the opponent by calling the client's getMove function, and then plays and displays the new board state.
-    # If the opponent has quit, the game display is cleared and the user is notified.
-    def _lanGetDisplayMove(self):
+    # Scheduled on the Tkinter main loop by the client's move callback each time the opponent's move is received during a Player v.s. Player LAN game.
+    # Given the move as a MoveDelta, plays it and displays the new board state (a delta of None means the connection was lost and the game couldn't be resumed).
+    # If the game has been forfeited (by the opponent quitting, or by the server rejecting the user's move), the connection to the server is closed, the game display is cleared and the user is notified.
+    def _lanDisplayMove(self, delta):
         if not self.playing:
             return
-        row, col = self.client.getMove()
-        if (row, col) == (-1, -1):
+        if delta is None:
+            self._lanConnectionLost()
+            return
+        if delta.isForfeit():
+            self.client.closeConnection()
             self.playing = False
             self._updateGameFrame()
             self._updateOptionFrame()
-            self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.MAIN else Game.P2
+            self.currGameRecord.game.winner = delta.winner
             self._addUserResult(self.player)
-            self._createNotificationWin("Opponent quit", "Your opponent has quit early - you have won the game (and your profile has been updated with the result)")
+            if self.currPlayers[delta.winner] == Player.MAIN:
+                self._createNotificationWin("Opponent quit", "Your opponent has quit early - you have won the game (and your profile has been updated with the result)")
+            else:
+                self._createNotificationWin("Move rejected", "The server rejected your move - you have lost the game (and your profile has been updated with the result)")
             return
-        self._play(row, col)
+        self._play(delta.row, delta.col, delta)
         self._updateState()
 
+    # Called if the connection to the server drops during a Player v.s. Player LAN game and the client can't resume the game.
+    # The server forfeits the game for a player that doesn't resume, so the user loses the game. The client's connection is closed, which also stops its heartbeats.
+    def _lanConnectionLost(self):
+        self.client.closeConnection()
+        self.playing = False
+        self._updateGameFrame()
+        self._updateOptionFrame()
+        self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.OPP else Game.P2
+        self._addUserResult(self.player)
+        self._createNotificationWin("Connection lost", "The connection to the server was lost - you have lost the game (and your profile has been updated with the result)")
+
     # Updates the display with the current game information such as the number of captured pieces and the board state.
     def _updateState(self):
         self.p1CapLabel.config(text=f"Player 1 captured pairs: {len(self.currGameRecord.game.captures[Game.P1])}")
         self.p2CapLabel.config(text=f"Player 2 captured pairs: {len(self.currGameRecord.game.captures[Game.P2])}")
 
-        prevMoves = [None, None]
-        try:
-            lastStack = self.currGameRecord.game.moveStack.pop()
-            prevMoves[0] = lastStack[1:]
-        except GameError:
-            pass
-        else:
-            try:
-                prevMoves[1] = self.currGameRecord.game.moveStack.peek()[1:]
-            except GameError:
-                pass
-            self.currGameRecord.game.moveStack.push(lastStack[0], lastStack[1], lastStack[2])
+        prevMoves = (self.currGameRecord.game.moveStack.getLastMoves(2) + [None, None])[:2]
 
         for row in range(len(self.currGameRecord.game.board)):
             for col in range(len(self.currGameRecord.game.board)):
@@ -955,24 +1062,14 @@ class Gui(Ui):
         else:
             self.playerNoPlayingLabel.config(text="Player 2 to play")
 
-    # Updates the image displayed for a single board cell given its position and the piece it should hold.
+    # Updates the image displayed for a single board cell given its position and the piece it should hold, using the cached images for the current board.
+    # The button is left alone if it already shows the image.
     def _updateCell(self, row, col, piece, mark=False):
-        if piece == Game.EMPTY:
-            filename = "emptyCell.png"
-        elif not mark:
-            if piece == Game.P1:
-                filename = "player1.png"
-            else:
-                filename = "player2.png"
-        else:
-            if piece == Game.P1:
-                filename = "player1Marked.png"
-            else:
-                filename = "player2Marked.png"
-        photoImg = PhotoImage(file=filename)
+        photoImg = self._sprites[(piece, mark and piece != Game.EMPTY)]
         button = self.buttons[row][col]
-        button.configure(image=photoImg)
-        button.image = photoImg
+        if button.image is not photoImg:
+            button.configure(image=photoImg)
+            button.image = photoImg
 
     # Updates the headLabel (the central label at the top of the GUI) to show the game winner.
     def _displayWin(self):
@@ -1011,35 +1108,39 @@ class Gui(Ui):
             self._updateState()
 
     # Given a move to play, calls the game method's play function to play the move.
+    # For an opponent's move in a LAN game, the MoveDelta sent by the server is given, and applied to the game instead of working out the new state again.
     # If the game has ended, the winner is displayed. Otherwise the label stating which player number is playing is switched.
-    def _play(self, row, col):
-        self.currGameRecord.game.play(row, col)
+    def _play(self, row, col, delta=None):
+        if delta is None:
+            self.currGameRecord.game.play(row, col)
+        else:
+            self.currGameRecord.game.applyMove(row, col, delta.capturedPairs, delta.winner)
         if self.currGameRecord.game.winner != Game.ONGOING:
             self._displayWin()
             self.playing = False
             if self.currGameRecord.mode != Mode.LAN:
-                changesMade = self._addResultsToProfile()
-                if changesMade:
-                    if self.currGameRecord.id != -1:
-                        self.currGameRecord.whenSaved = datetime.now()
-                        Database.updateGame(self.currGameRecord)
-                        txt = "Your profile has been updated with the game result, and your saved game has been updated."
-                    else:
-                        txt = "Your profile has been updated with the game result."
-                    self._createNotificationWin("Profile updated", txt)
+                self._addResultsToProfile(self._resultsAdded)
             else:
                 self.client.closeConnection()
                 self._addUserResult(self.player)
                 self._createNotificationWin("Profile updated", "Your profile has been updated with the game result.")
 
+    # Run once the results of a finished game have been added to the players' profiles, given whether the saved game was updated along with them. Creates a window notifying the user.
+    def _resultsAdded(self, gameUpdated):
+        if gameUpdated:
+            txt = "Your profile has been updated with the game result, and your saved game has been updated."
+        else:
+            txt = "Your profile has been updated with the game result."
+        self._createNotificationWin("Profile updated", txt)
+
     # Called when starting a Player v.s. Player LAN game.
     # Makes a connection between the client and server and gets an opponent using the client's methods.
     # Calls the playGame function to start the game.
     def _connectAndGetOpp(self):
         self.client.makeConnection()
-        self.client.getOpponent()
+        self.client.getOpponent(Database.getPlayer(self.player)[4])
         self.opponent = self.client.opponent
-        self._playGame(self.client.playerNo, Mode.LAN)
+        self.root.after(0, self._playGame, self.client.playerNo, Mode.LAN)
 
     # Called when starting a Player v.s. Player LAN game.
     # Creates a new client and calls the connectAndGetOpp function to start the client-server interaction.
@@ -1047,7 +1148,7 @@ class Gui(Ui):
         playGameWindow.destroy()
         self.client = Client(self.player)
         self.headLabel.config(text="Waiting for opponent...")
-        x = threading.Thread(target=self._connectAndGetOpp)
+        x = threading.Thread(target=self._connectAndGetOpp, daemon=True)
         x.start()
         
 # The Terminal class is a subclass of the Ui class, and contains all properties and methods required for the terminal-based user interface.
@@ -1192,8 +1293,8 @@ Choose an option:
     # Displays the player's profile information.
     def _viewProfile(self):
         whenSaved, numberOfWins, numberOfLosses, numberOfDraws, score = Database.getPlayer(self.player)
-        numberOfSavedGames = len(Database.loadAllGames(self.player))
-        numberOfOngoings = len(Database.loadGames(self.player, Game.ONGOING))
+        numberOfSavedGames = Database.countGames(self.player)
+        numberOfOngoings = Database.countGames(self.player, Game.ONGOING)
         totalNumberOfGames = sum([numberOfWins, numberOfLosses, numberOfDraws])
         rank = Database.getPlayerRank(self.player)
         profileString = f"""
@@ -1365,7 +1466,7 @@ Profile created on {datetime.strftime(whenSaved, "%d/%m/%Y, %H:%M:%S")}
                 print(f"{i+1}. {Ui._gameString(gameRecord)}")
             print("Select a game (e.g. 1, 2...)")
             inp = Terminal._getChoice(1, i+1)
-            self.currGameRecord = games[inp-1]
+            self.currGameRecord = Database.getGame(games[inp-1].id)
             mainPlayerPos = self._loadPlayers()
             self.currPlayers[mainPlayerPos] = Player.MAIN
             otherPlayer = Game.P1 if mainPlayerPos == Game.P2 else Game.P2
@@ -1471,19 +1572,26 @@ Profile created on {datetime.strftime(whenSaved, "%d/%m/%Y, %H:%M:%S")}
                 self.currGameRecord.game.play(row, col)
             elif self.currGameRecord.mode == Mode.LAN and self.currPlayers[self.currGameRecord.game.player] != Player.MAIN:
                 print(f"Waiting for {self.client.opponent} to play...")
-                row, col = self.client.getMove()
-                if (row, col) == (-1, -1):
+                try:
+                    delta = self.client.getMove()
+                except ConnectionError:
+                    self._lanConnectionLost()
+                    return
+                if delta.isForfeit():
                     self.client.closeConnection()
-                    self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.MAIN else Game.P2
+                    self.currGameRecord.game.winner = delta.winner
                     self._addUserResult(self.player)
-                    print("Your opponent has quit - you have automatically won the game.")
+                    if self.currPlayers[delta.winner] == Player.MAIN:
+                        print("Your opponent has quit - you have automatically won the game.")
+                    else:
+                        print("The server rejected your move - you have lost the game.")
                     print()
                     print("Your profile has been updated with the game result.")
                     input("Press any key to continue > ")
                     return
                 else:
-                    self.currGameRecord.game.play(row, col)
-                    print(f"{self.client.opponent} played: {row+1}{chr(col+65)}")
+                    self.currGameRecord.game.applyMove(delta.row, delta.col, delta.capturedPairs, delta.winner)
+                    print(f"{self.client.opponent} played: {delta.row+1}{chr(delta.col+65)}")
             else:
                 choice, isMove, end = self._getMove()
                 if not isMove:
@@ -1499,7 +1607,8 @@ Profile created on {datetime.strftime(whenSaved, "%d/%m/%Y, %H:%M:%S")}
                 else:
                     row, col = choice
                     self.currGameRecord.game.play(row, col)
-                    if self.currGameRecord.mode == Mode.LAN: self.client.makeMove((row, col))
+                    if self.currGameRecord.mode == Mode.LAN:
+                        self.client.makeMove((row, col))
         self._printState()
         if self.currGameRecord.game.winner == Game.P1:
             print("Player 1 has won!")
@@ -1516,14 +1625,23 @@ Profile created on {datetime.strftime(whenSaved, "%d/%m/%Y, %H:%M:%S")}
             changesMade = self._addResultsToProfile()
             if changesMade:
                 if self.currGameRecord.id != -1:
-                    self.currGameRecord.whenSaved = datetime.now()
-                    Database.updateGame(self.currGameRecord)
                     txt = "Your profile has been updated with the game result, and your saved game has been updated."
                 else:
                     txt = "Your profile has been updated with the game result."
                 print(txt)
             input("Enter any key to go back > ")
 
+    # Called if the connection to the server drops during a Player v.s. Player LAN game and the client can't resume the game.
+    # The server forfeits the game for a player that doesn't resume, so the user loses the game.
+    def _lanConnectionLost(self):
+        self.client.closeConnection()
+        self.currGameRecord.game.winner = Game.P1 if self.currPlayers[Game.P1] == Player.OPP else Game.P2
+        self._addUserResult(self.player)
+        print("The connection to the server was lost - you have lost the game.")
+        print()
+        print("Your profile has been updated with the game result.")
+        input("Press any key to continue > ")
+
     # Creates a new client instance, connects it to the server, and obtains an opponent.
     def _connectLan(self):
         self.client = Client(self.player)
@@ -1531,7 +1649,7 @@ Profile created on {datetime.strftime(whenSaved, "%d/%m/%Y, %H:%M:%S")}
         self.client.makeConnection()
         print("Connected.")
         print("Waiting for opponent...")
-        self.client.getOpponent()
+        self.client.getOpponent(Database.getPlayer(self.player)[4])
         self.opponent = self.client.opponent
         playerNo = 1 if self.client.playerNo == Game.P1 else 2
         oppNo = 1 if playerNo == 2 else 2